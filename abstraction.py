@@ -0,0 +1,217 @@
+"""
+Card abstraction
+
+A CardAbstraction groups the combos of each player's range into buckets
+on every board a solve reaches, the initial board and the runout below
+every public chance node. Trainers keep one infoset row per bucket
+instead of one per combo, see GameTree.hand_rows, so wide ranges and
+turn or flop trees fit in memory.
+
+Combos are clustered with k-means, as in Clustering.ipynb, on features of
+their river equity against the opponent's weighted range:
+
+    'strength'   mean equity and mean squared equity over the river boards
+                 the board can run out to, the notebook's ev and ev_2 with
+                 equity in place of the treys score, its per card
+                 card1_ev and card2_ev are not used
+    'histogram'  cumulative histogram of equity over the river boards,
+                 squared distances between cumulative histograms track
+                 the earth mover's distance between the histograms, river
+                 boards use 'strength'
+
+Buckets only depend on the options, board, ranges and weights, and are
+saved to cache_dir keyed by a hash of them, so later solves of a board
+load them instead of clustering again.
+
+    abstraction = CardAbstraction(n_buckets=50, features='histogram',
+            cache_dir='buckets')
+    config = GameConfig.from_strings(board, p1, p2, abstraction=abstraction)
+"""
+import hashlib
+import itertools
+import os
+
+import numpy as np
+
+from state import CARD_INDEX, INDEX_CARD, DECK_SIZE, range_cards
+from tree import range_unblocked
+from equity import combo_index, full_weights, showdown_equity
+
+FEATURES = ('strength', 'histogram')
+
+
+def river_equity(board, ranges, weights, player) -> np.ndarray:
+    """
+    Return equity of each combo of player against the opponent's weighted
+    range on a 5 card board, nan for combos blocked by the board or facing
+    no opponent combo
+    @param board: list of treys cards
+    """
+    opponent = full_weights(ranges[1 - player], weights[1 - player])
+    return showdown_equity(board, opponent)[combo_index(ranges[player])]
+
+
+def kmeans(points, k, seed=0, max_iterations=100) -> np.ndarray:
+    """
+    Return cluster of each row of points, k-means++ seeding then Lloyd
+    iterations, deterministic for a seed
+    """
+    rng = np.random.RandomState(seed)
+    n = len(points)
+    centers = np.empty((k, points.shape[1]))
+    centers[0] = points[rng.randint(n)]
+    dist = ((points - centers[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        # far points are likelier to seed the next cluster
+        total = dist.sum()
+        j = rng.choice(n, p=dist / total) if total > 0 else rng.randint(n)
+        centers[i] = points[j]
+        dist = np.minimum(dist, ((points - centers[i]) ** 2).sum(axis=1))
+
+    labels = np.full(n, -1)
+    for _ in range(max_iterations):
+        dist = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_labels = dist.argmin(axis=1)
+        if np.array_equal(new_labels, labels): break
+        labels = new_labels
+        for i in range(k):
+            members = points[labels == i]
+            if len(members):
+                centers[i] = members.mean(axis=0)
+    return labels
+
+
+class CardAbstraction:
+    """Buckets of each player's combos on each board of a solve"""
+    def __init__(self, n_buckets=50, features='strength', n_bins=10,
+            rollouts=200, seed=0, cache_dir=None):
+        """
+        @param n_buckets: buckets per board and player, combos with equal
+            features always share a bucket
+        @param features: 'strength' or 'histogram', see FEATURES
+        @param n_bins: equity bins of 'histogram'
+        @param rollouts: most river boards sampled per board before the
+            river, all of them if None
+        @param seed: seed of the rollout sample and k-means
+        @param cache_dir: directory to save buckets to, None for memory only
+        """
+        if features not in FEATURES:
+            raise ValueError(f'unknown features {features}')
+        self.n_buckets = n_buckets
+        self.features = features
+        self.n_bins = n_bins
+        self.rollouts = rollouts
+        self.seed = seed
+        self.cache_dir = cache_dir
+        self._buckets = dict()
+
+    def key(self) -> tuple:
+        """Hashable description, equal for abstractions bucketing alike"""
+        return (self.n_buckets, self.features, self.n_bins, self.rollouts,
+                self.seed)
+
+    def to_dict(self) -> dict:
+        return {'n_buckets': self.n_buckets, 'features': self.features,
+                'n_bins': self.n_bins, 'rollouts': self.rollouts,
+                'seed': self.seed, 'cache_dir': self.cache_dir}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def buckets(self, board, ranges, weights, player) -> np.ndarray:
+        """
+        Return bucket 0..n - 1 of each combo of player on board, combos
+        that can't be dealt on board are in bucket 0
+        @param board: list of treys cards, 3 to 5 of them
+        """
+        digest = self._digest(board, ranges, weights, player)
+        buckets = self._buckets.get(digest)
+        if buckets is not None:
+            return buckets
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, digest + '.npy')
+            if os.path.exists(path):
+                buckets = np.load(path)
+        if buckets is None:
+            buckets = self._cluster(board, ranges, weights, player)
+            if path is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # write then rename, so readers never see half a file
+                tmp = path + '.tmp.npy'
+                np.save(tmp, buckets)
+                os.replace(tmp, path)
+        self._buckets[digest] = buckets
+        return buckets
+
+    def _digest(self, board, ranges, weights, player) -> str:
+        h = hashlib.sha1(repr((self.key(), player,
+            sorted(CARD_INDEX[c] for c in board))).encode())
+        for (combos, w) in zip(ranges, weights):
+            h.update(range_cards(combos).tobytes())
+            h.update(np.asarray(w, dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+    def rivers(self, board) -> list:
+        """Return river boards board runs out to, sampled past rollouts"""
+        dead = set(CARD_INDEX[c] for c in board)
+        deck = [c for c in range(DECK_SIZE) if c not in dead]
+        runouts = list(itertools.combinations(deck, 5 - len(board)))
+        if self.rollouts is not None and len(runouts) > self.rollouts:
+            rng = np.random.RandomState(self.seed)
+            picked = rng.choice(len(runouts), self.rollouts, replace=False)
+            runouts = [runouts[i] for i in sorted(picked)]
+        return [list(board) + [INDEX_CARD[c] for c in cards]
+                for cards in runouts]
+
+    def features_of(self, board, ranges, weights, player) -> np.ndarray:
+        """
+        Return (n_combos x n_features) features of player's combos on
+        board, nan rows for combos that can't be dealt
+        """
+        unblocked = range_unblocked(ranges[player])
+        # a river board has one equity, its histogram would be one bin
+        strength = self.features == 'strength' or len(board) == 5
+        if strength:
+            sums = np.zeros((len(ranges[player]), 2))
+        else:
+            sums = np.zeros((len(ranges[player]), self.n_bins))
+        counts = np.zeros(len(ranges[player]))
+        for river in self.rivers(board):
+            equity = river_equity(river, ranges, weights, player)
+            dealt = ~np.isnan(equity)
+            if strength:
+                sums[dealt, 0] += equity[dealt]
+                sums[dealt, 1] += equity[dealt] ** 2
+            else:
+                bins = np.minimum((equity[dealt] * self.n_bins).astype(int),
+                        self.n_bins - 1)
+                sums[np.flatnonzero(dealt), bins] += 1
+            counts += dealt
+        features = np.full(sums.shape, np.nan)
+        np.divide(sums, counts[:, None], out=features,
+                where=counts[:, None] > 0)
+        if not strength:
+            features = np.cumsum(features, axis=1)
+        # combos holding a board card are never dealt
+        for c in board:
+            features[unblocked[CARD_INDEX[c]] == 0] = np.nan
+        return features
+
+    def _cluster(self, board, ranges, weights, player) -> np.ndarray:
+        features = self.features_of(board, ranges, weights, player)
+        dealt = ~np.isnan(features).any(axis=1) \
+                & (np.asarray(weights[player]) > 0)
+        buckets = np.zeros(len(features), dtype=np.int64)
+        if not dealt.any():
+            return buckets
+        points, labels = np.unique(features[dealt], axis=0,
+                return_inverse=True)
+        labels = labels.ravel()
+        if len(points) > self.n_buckets:
+            # cluster distinct points, combos with equal features can't split
+            labels = kmeans(points, self.n_buckets, self.seed)[labels]
+        # number the buckets in use 0..n - 1
+        _, buckets[dealt] = np.unique(labels, return_inverse=True)
+        return buckets
@@ -0,0 +1,123 @@
+"""
+Solve many boards against many range pairs
+
+Every board is solved against every range pair. Work that only depends
+on the ranges or the betting is done once per worker process and reused
+for every board: parsed ranges, combo card masks and indexes, and the
+betting tree. Per board only the chance table, showdown ranks and
+showdown engines are built. Boards of the same range pair are grouped
+into tasks, which are spread over a pool of worker processes.
+
+    python batch.py boards.txt --ranges 'QQ+ AK' 'JJ+ AQ+' --budget 5
+
+where boards.txt has one board per line, e.g. Td9d6h2h2c
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+
+from server import SolveJob, solve, DEFAULT_RANGE
+
+
+def parse_board(board) -> list:
+    """Return list of card strs of 'Td9d6h2h2c', 'Td 9d ...' or a list"""
+    if not isinstance(board, str):
+        return list(board)
+    board = board.replace(' ', '').replace(',', '')
+    return [board[i:i + 2] for i in range(0, len(board), 2)]
+
+
+def _solve_task(task):
+    """Solve boards of one range pair in a worker, return result dicts"""
+    p1_range, p2_range, boards, job_options, out_dir = task
+    results = []
+    for board in boards:
+        job = SolveJob(board, p1_range, p2_range, **job_options)
+        path = None
+        if out_dir is not None:
+            path = os.path.join(out_dir, job.job_id)
+        t0 = time.perf_counter()
+        result = solve(job, lambda progress: None, checkpoint_path=path)
+        result.update({'job_id': job.job_id, 'board': job.board,
+            'p1_range': p1_range, 'p2_range': p2_range,
+            'wall_seconds': time.perf_counter() - t0})
+        results.append(result)
+    return results
+
+
+def batch_tasks(boards, range_pairs, job_options, n_workers, out_dir=None):
+    """
+    Split boards x range pairs into tasks of boards sharing a range pair,
+    about four per worker so the pool stays busy near the end
+    """
+    boards = [parse_board(b) for b in boards]
+    n_tasks = max(1, 4 * n_workers // max(len(range_pairs), 1))
+    size = max(1, -(-len(boards) // n_tasks))
+    return [(p1, p2, boards[i:i + size], job_options, out_dir)
+            for (p1, p2) in range_pairs
+            for i in range(0, len(boards), size)]
+
+
+def solve_batch(boards, range_pairs=None, n_workers=None, out_dir=None,
+        **job_options):
+    """
+    Solve every board against every range pair
+    @param boards: list of boards, see parse_board
+    @param range_pairs: list of (p1 range str, p2 range str)
+    @param out_dir: directory to save a checkpoint of every solve to
+    @param job_options: trainer, options, target_mbb, budget,
+        max_iterations as in server.SolveJob
+    @return: iterator of result dicts, in order of completion
+    """
+    range_pairs = range_pairs or [(DEFAULT_RANGE, DEFAULT_RANGE)]
+    n_workers = n_workers or os.cpu_count()
+    # validate every job up front rather than in a worker
+    for board in boards:
+        for (p1, p2) in range_pairs:
+            SolveJob(parse_board(board), p1, p2, **job_options)
+
+    tasks = batch_tasks(boards, range_pairs, job_options, n_workers, out_dir)
+    ctx = mp.get_context('fork')
+    with ctx.Pool(n_workers) as pool:
+        for results in pool.imap_unordered(_solve_task, tasks):
+            yield from results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('boards', help='file with one board per line')
+    parser.add_argument('--ranges', nargs=2, action='append',
+            metavar=('P1', 'P2'), help='range pair, may be repeated')
+    parser.add_argument('--trainer', default='dcfr')
+    parser.add_argument('--budget', type=float, default=10,
+            help='training seconds per solve')
+    parser.add_argument('--target-mbb', type=float, default=None)
+    parser.add_argument('--max-iterations', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--checkpoints', default=None,
+            help='directory to save a checkpoint of every solve to')
+    parser.add_argument('--out', default='batch.jsonl')
+    args = parser.parse_args(argv)
+
+    with open(args.boards) as f:
+        boards = [line.strip() for line in f if line.strip()]
+
+    t0 = time.perf_counter()
+    n = 0
+    with open(args.out, 'w') as out:
+        for result in solve_batch(boards, args.ranges, args.workers,
+                args.checkpoints, trainer=args.trainer, budget=args.budget,
+                target_mbb=args.target_mbb,
+                max_iterations=args.max_iterations):
+            out.write(json.dumps(result) + '\n')
+            n += 1
+            print(f"{''.join(result['board'])} {result['iterations']:>8} it "
+                    f"{result['mbb_per_pot']:10.2f} mbb/pot")
+    print(f'{n} solves in {time.perf_counter() - t0:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
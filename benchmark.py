@@ -0,0 +1,200 @@
+"""
+Benchmark trainers on canonical river spots
+
+Reports iterations/sec, nodes/sec, peak memory and exploitability against
+training wall clock time for every (spot, trainer) pair, and writes the
+results as json so runs can be diffed.
+
+    python benchmark.py --budget 30 --out bench.json
+    python benchmark.py --spots narrow --trainers dcfr mccfr --baseline bench.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import time
+from queue import Empty
+
+import numpy as np
+
+from state import GameConfig
+from cfr import (CFRTrainer, MCCFRTrainer, VectorCFRTrainer, CFRPlusTrainer,
+        DCFRTrainer)
+from parallel import ParallelMCCFRTrainer
+from exploitability import exploitability
+
+BOARD = ['Td', '9d', '6h', '2h', '2c']
+
+WIDE_RANGE = '22+ A2+ K2+ Q2+ J2+ T2+ 92+ 82+ 72+ 62+ 52+ 42+ 32+'
+
+# name -> (board, p1 range, p2 range)
+SPOTS = {
+    'narrow': (BOARD, 'QQ+ KQ+ AQ+', 'QQ+ KQ+ AQ+'),
+    'default': (BOARD, '88+ AJo+ ATs+ KQ KJ JTs T9s',
+        '88+ AJo+ ATs+ KQ KJ JTs T9s'),
+    'wide': (BOARD, WIDE_RANGE, WIDE_RANGE),
+}
+
+# name -> (trainer factory, iterations between exploitability samples)
+TRAINERS = {
+    'cfr': (CFRTrainer, 1),
+    'mccfr': (MCCFRTrainer, 1000),
+    'parallel_mccfr': (ParallelMCCFRTrainer, 1000),
+    'vector_cfr': (VectorCFRTrainer, 10),
+    'cfr_plus': (CFRPlusTrainer, 10),
+    'dcfr': (DCFRTrainer, 10),
+}
+
+
+def make_state(spot):
+    """Return initial state of spot"""
+    board, p1, p2 = SPOTS[spot]
+    return GameConfig.from_strings(board, p1, p2).initial_state()
+
+
+def _peak_rss_mb():
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_case(spot, trainer_name, budget, queue):
+    """Train until budget seconds of training, streaming samples to queue"""
+    factory, chunk = TRAINERS[trainer_name]
+    t0 = time.perf_counter()
+    trainer = factory(make_state(spot))
+    queue.put(('setup', time.perf_counter() - t0, trainer._tree.n_nodes))
+
+    iterations = 0
+    seconds = 0.0
+    while seconds < budget:
+        t0 = time.perf_counter()
+        # train(T) runs T - 1 iterations
+        trainer.train(chunk + 1)
+        seconds += time.perf_counter() - t0
+        iterations += chunk
+        queue.put(('sample', iterations, seconds, trainer._nodes_touched,
+            float(exploitability(trainer)), _peak_rss_mb()))
+    queue.put(('done',))
+
+
+def run_case(spot, trainer_name, budget, timeout):
+    """Run one case in a fresh process and return its result dict"""
+    result = {'spot': spot, 'trainer': trainer_name, 'status': 'ok',
+            'curve': []}
+    ctx = mp.get_context('fork')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_case,
+            args=(spot, trainer_name, budget, queue))
+    process.start()
+
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            msg = queue.get(timeout=max(remaining, 0.01))
+        except Empty:
+            if not process.is_alive() or remaining <= 0:
+                result['status'] = 'timeout' if remaining <= 0 else 'crashed'
+                break
+            continue
+        if msg[0] == 'setup':
+            result['setup_seconds'] = msg[1]
+            result['tree_nodes'] = msg[2]
+        elif msg[0] == 'sample':
+            _, iterations, seconds, nodes, expl, rss = msg
+            result['curve'].append({'iterations': iterations,
+                'seconds': seconds, 'exploitability': expl})
+            result['peak_rss_mb'] = rss
+            result['nodes'] = nodes
+        else:
+            break
+    if process.is_alive():
+        process.terminate()
+    process.join()
+
+    if result['curve']:
+        last = result['curve'][-1]
+        result['iterations'] = last['iterations']
+        result['train_seconds'] = last['seconds']
+        result['iterations_per_sec'] = last['iterations'] / last['seconds']
+        result['nodes_per_sec'] = result['nodes'] / last['seconds']
+        result['exploitability'] = last['exploitability']
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline):
+    """Print iterations/sec and exploitability against a previous run"""
+    old = {(r['spot'], r['trainer']): r for r in baseline['results']}
+    for r in results:
+        prev = old.get((r['spot'], r['trainer']))
+        if prev is None or 'iterations_per_sec' not in prev \
+                or 'iterations_per_sec' not in r:
+            continue
+        speedup = r['iterations_per_sec'] / prev['iterations_per_sec']
+        print(f"{r['spot']:>8} {r['trainer']:>15} "
+                f"{speedup:6.2f}x it/s  exploitability "
+                f"{prev['exploitability']:.4f} -> {r['exploitability']:.4f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--spots', nargs='+', default=list(SPOTS),
+            choices=list(SPOTS))
+    parser.add_argument('--trainers', nargs='+', default=list(TRAINERS),
+            choices=list(TRAINERS))
+    parser.add_argument('--budget', type=float, default=10,
+            help='training seconds per case')
+    parser.add_argument('--timeout', type=float, default=None,
+            help='wall clock seconds before a case is killed '
+                 '(default 3x budget + 60)')
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--baseline', default=None,
+            help='previous json output to compare against')
+    args = parser.parse_args(argv)
+    timeout = args.timeout or 3 * args.budget + 60
+
+    results = []
+    for spot in args.spots:
+        for trainer_name in args.trainers:
+            r = run_case(spot, trainer_name, args.budget, timeout)
+            results.append(r)
+            print(f"{spot:>8} {trainer_name:>15} {r['status']:>8} "
+                    f"{r.get('iterations_per_sec', 0):10.1f} it/s "
+                    f"{r.get('nodes_per_sec', 0):12.0f} nodes/s "
+                    f"{r.get('peak_rss_mb', 0):8.1f} MB "
+                    f"expl {r.get('exploitability', float('nan')):.4f}")
+
+    report = {
+        'meta': {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'budget': args.budget,
+        },
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
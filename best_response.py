@@ -1,93 +1,78 @@
-from copy import deepcopy
-import collections
+import numpy as np
 
-from state import State
-
-def _memoize_method(method):
-  """Memoize a single-arg instance method using an on-object cache."""
-  cache_name = "cache_" + method.__name__
-
-  def wrap(self, arg):
-    key = str(arg)
-    cache = vars(self).setdefault(cache_name, {})
-    if key not in cache:
-      cache[key] = method(self, arg)
-    return cache[key]
-
-  return wrap
+from tree import ROOT
+from showdown import TerminalEvaluator
 
 class BestResponsePolicy:
-    def __init__(self, player_id, trainer):
-        self._player_id = player_id
+    """
+    Best response of one player to the trainer's average strategy.
 
-        self._root_state = trainer._initial_state
+    The tree is walked once: the opponent's reach vector over its range
+    goes down, and the counterfactual value of every hand of the best
+    responder comes back up. At the best responder's nodes each hand
+    takes the max over actions, which is exact because its infoset is the
+    (hand, public node) pair.
+    """
+    def __init__(self, player_id, trainer, terminals=None):
+        """
+        @param terminals: TerminalEvaluator to reuse, built if None
+        """
+        self._player_id = player_id
         # cfr trainer object
         self._trainer = trainer
-        # dict of string->(state, cf_reach_prob)
-        self._infosets = self.get_infosets(trainer._initial_state)
+        self._tree = trainer._tree
+        self._terminals = terminals or TerminalEvaluator(self._tree)
+        # counterfactual value of each hand, computed on first use
+        self._hand_values = None
+        # best action index of each hand, by decision node
+        self._actions = dict()
 
-    def get_infosets(self, state):
-        infosets = collections.defaultdict(list)
-        for s, p in self.decision_nodes(state):
-            infosets[s.infoset_str(self._player_id)].append((s, p))
-        return infosets
+    def hand_values(self) -> np.ndarray:
+        """Return counterfactual value of each hand of best responder"""
+        if self._hand_values is None:
+            opp_reach = self._terminals.initial_reach[1 - self._player_id]
+            self._hand_values = self._values(ROOT, opp_reach)
+        return self._hand_values
 
-    def decision_nodes(self, parent_state):
+    def value(self) -> float:
         """
-        generator to traverse tree and yield (state, cfr_prob) pairs
+        Main entry point
+        Return value of root to best responder
         """
-        if not parent_state.is_terminal:
-            if parent_state.current == self._player_id:
-                yield (parent_state, 1.0)
-            for action, p_action in self.transitions(parent_state):
-                for state, p_state in self.decision_nodes(
-                        parent_state.apply_action(action)):
-                    yield (state, p_state * p_action)
+        return self.hand_values().sum()
 
-    def q_value(self, state, action):
-        """
-        Returns the value of the (state, action) to the best-responder.
-        """
-        return self.value(state.apply_action(action))
+    def best_response_action(self, node, hand) -> int:
+        """Return index of best child of node for hand"""
+        self.hand_values()
+        return self._actions[node][hand]
 
-    def transitions(self, state):
-        """
-        Returns a list of (action cf prob pairs for the state)
-        """
-        if state.current == self._player_id:
-            return [(action, 1.0) for action in state.legal_actions]
-        elif state.is_chance:
-            chance_outcomes = state.legal_actions
-            n_outcomes = len(chance_outcomes)
-            return [(outcome, 1.0 / n_outcomes) for outcome in chance_outcomes]
-        else: # get average strategy of player and return probability dist of actions
-            legal_actions = state.legal_actions
-            # get current avg strategy for state
-            action_probs = self._trainer.get_or_create(
-                    state.infoset_str(state.current),
-                    len(legal_actions)).get_final_strategy()
-            return [(legal_actions[i], action_probs[i]) for i in range(len(action_probs))]
+    def _values(self, node, opp_reach) -> np.ndarray:
+        tree = self._tree
+        if tree.is_terminal(node):
+            return self._terminals.values(node, self._player_id, opp_reach)
 
-    @_memoize_method
-    def best_response_action(self, infostate):
-        infoset = self._infosets[infostate]
-        return max(
-                infoset[0][0].legal_actions,
-                key=lambda a: sum(cf_p * self.q_value(s, a) for s, cf_p in infoset))
+        if tree.is_chance(node):
+            me, opp = self._player_id, 1 - self._player_id
+            value = 0
+            for child in tree.children(node):
+                card = tree.action[child]
+                value = value + tree.deal_values(child, me,
+                        tree.deal_prob[child] * tree.unblocked[me][card]
+                        * self._values(child,
+                            opp_reach * tree.unblocked[opp][card]))
+            return value
 
-    @_memoize_method
-    def value(self, state):
-        """
-        Main entry point
-        Return value of state to best responder
-        """
-        if state.is_terminal:
-            return state.get_utility()[self._player_id]
-        elif state.current == self._player_id:
-            action = self.best_response_action(
-                    state.infoset_str(self._player_id))
-            return self.q_value(state, action)
-        else:
-            return sum(
-                    p * self.q_value(state, a) for a, p in self.transitions(state))
+        children = tree.children(node)
+        if tree.player[node] == self._player_id:
+            q_values = np.stack(
+                    [self._values(child, opp_reach) for child in children])
+            self._actions[node] = q_values.argmax(axis=0)
+            return q_values.max(axis=0)
 
+        # opponent plays its average strategy
+        table = self._trainer._infosets
+        sigma = table.hand_view(node, table.node_average_strategy(node))
+        value = 0
+        for (i, child) in enumerate(children):
+            value = value + self._values(child, opp_reach * sigma[:, i])
+        return value
@@ -0,0 +1,235 @@
+"""
+Bet sizing abstraction
+
+A BetSizing lists the bet and raise sizes allowed at each street and
+raise depth, as fractions of the pot, plus the min raise, all in and
+raise cap rules. It builds the betting arrays of a GameTree directly from
+chip counts, without walking State copies. Sizes that come out to the
+same amount at a node, e.g. two sizes that both cap to all in, are
+merged into one action. Before the river, a street ends in a chance node
+dealing the next card, once a player is all in the rest of the board is
+dealt without betting.
+
+    sizing = BetSizing([[0.33, 0.75, 1.5], [0.75]], raise_cap=2)
+    config = GameConfig.from_strings(board, p1, p2, betting=sizing)
+    print(tree_stats(config))
+"""
+import numpy as np
+
+from state import (PLAYER_1_ID, CHANCE_ID, TERMINAL_ID, CHECK,
+        FOLD, CALL, SIZED_BET, MAX_SIZES, ALL_IN, RIVER, DECK_SIZE, CARD_INDEX,
+        HISTORY_BASE, encode_history, history_digit, history_card)
+from tree import (NOT_TERMINAL, SHOWDOWN, P1_FOLDED, P2_FOLDED, build_tree,
+        layout_tree)
+from infosets import InfosetTable
+
+
+def _depth_sizes(sizes):
+    """Return tuple of tuples of fractions, one per raise depth"""
+    sizes = list(sizes)
+    if not sizes or not isinstance(sizes[0], (list, tuple)):
+        sizes = [sizes]
+    return tuple(tuple(float(f) for f in depth) for depth in sizes)
+
+
+class BetSizing:
+    """Bet and raise sizes of every street and raise depth"""
+    def __init__(self, sizes=(1.0,), street_sizes=None, raise_cap=3,
+            allin=True, allin_threshold=0.67, min_bet=1):
+        """
+        @param sizes: fractions of the pot, either one list for every
+            depth or a list per depth, [bets, first raises, ...], where the
+            last list is used for deeper raises. A bet of f puts f * pot in,
+            a raise of f raises by f times the pot after calling
+        @param street_sizes: dict of street -> sizes, overriding sizes
+        @param raise_cap: raises allowed after the first bet of a street
+        @param allin: always allow going all in
+        @param allin_threshold: sizes putting in at least this fraction of
+            the chips a player can still bet become all in
+        @param min_bet: smallest bet, raises must be at least as big as
+            the bet or raise they raise
+        """
+        self.sizes = _depth_sizes(sizes)
+        self.street_sizes = {int(street): _depth_sizes(s)
+                for (street, s) in (street_sizes or dict()).items()}
+        self.raise_cap = raise_cap
+        self.allin = allin
+        self.allin_threshold = allin_threshold
+        self.min_bet = min_bet
+
+        # every distinct fraction, each gets its own action id
+        fractions = set(f for depth in self.sizes for f in depth)
+        for sizes in self.street_sizes.values():
+            fractions.update(f for depth in sizes for f in depth)
+        self.fractions = sorted(fractions)
+        if len(self.fractions) > MAX_SIZES:
+            raise ValueError(f'at most {MAX_SIZES} distinct sizes are supported')
+
+    def key(self) -> tuple:
+        """Hashable description, equal for sizings building the same tree"""
+        return (self.sizes, tuple(sorted(self.street_sizes.items())),
+                self.raise_cap, self.allin, self.allin_threshold, self.min_bet)
+
+    def to_dict(self) -> dict:
+        return {'sizes': [list(d) for d in self.sizes],
+                'street_sizes': {s: [list(d) for d in sizes]
+                    for (s, sizes) in self.street_sizes.items()},
+                'raise_cap': self.raise_cap, 'allin': self.allin,
+                'allin_threshold': self.allin_threshold,
+                'min_bet': self.min_bet}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def action_id(self, fraction) -> int:
+        return SIZED_BET + self.fractions.index(fraction)
+
+    def depth_sizes(self, street, depth) -> tuple:
+        """Return fractions allowed at street for the depth-th bet or raise"""
+        sizes = self.street_sizes.get(street, self.sizes)
+        return sizes[min(depth, len(sizes) - 1)]
+
+    def actions(self, street, pot, contrib, stack, player, n_raises,
+            last_raise) -> list:
+        """
+        Return (action id, wager after the action) of every legal action
+        @param pot: chips in the middle, including this street's wagers
+        @param contrib: chips each player put in this street
+        @param stack: chips each player has behind
+        @param n_raises: raises after the first bet this street
+        @param last_raise: size of the last bet or raise this street
+        """
+        me, opp = player, 1 - player
+        to_call = contrib[opp] - contrib[me]
+        # wager after which one of the players is all in
+        max_to = min(contrib[me] + stack[me], contrib[opp] + stack[opp])
+        actions = []
+        if to_call == 0:
+            actions.append((CHECK, contrib[me]))
+        else:
+            actions.append((FOLD, contrib[me]))
+            actions.append((CALL, contrib[opp]))
+
+        can_raise = max_to > contrib[opp] \
+                and (to_call == 0 or n_raises < self.raise_cap)
+        if not can_raise:
+            return actions
+
+        depth = 0 if to_call == 0 else n_raises + 1
+        min_to = contrib[opp] + max(last_raise, self.min_bet)
+        seen = set()
+        for f in self.depth_sizes(street, depth):
+            if to_call == 0:
+                to = f * pot
+            else:
+                to = contrib[opp] + f * (pot + to_call)
+            to = max(int(round(to)), min_to)
+            if to >= max_to or to - contrib[me] >= \
+                    self.allin_threshold * (max_to - contrib[me]):
+                to = max_to
+            if to in seen: continue
+            seen.add(to)
+            actions.append((ALL_IN if to == max_to else self.action_id(f), to))
+        if self.allin and max_to not in seen:
+            actions.append((ALL_IN, max_to))
+        return actions
+
+    def build(self, config, symmetries=None) -> dict:
+        """
+        Walk the betting of config street by street, return tree arrays
+        @param symmetries: suit perms dealt cards are merged by
+        """
+        # decision node = (player, history key, pot before this street,
+        #     contrib, stack, n_raises, last_raise, actions this street,
+        #     street, mask of board cards)
+        # chance node = (CHANCE_ID, history key, pot, stack, street dealt,
+        #     mask of board cards)
+        # terminal node = (TERMINAL_ID, history key, pot, payoff)
+        root = (PLAYER_1_ID, encode_history('dd'), config.pot, (0, 0),
+                (config.stack, config.stack), 0, 0, 0, config.street,
+                config.dead)
+        board = [CARD_INDEX[c] for c in config.board]
+        return layout_tree(root, self._expand, board, symmetries)
+
+    def _expand(self, node) -> tuple:
+        """expand function of tree.layout_tree"""
+        if node[0] == TERMINAL_ID:
+            _, key, pot, payoff = node
+            return (TERMINAL_ID, -1, pot, payoff, key, [])
+
+        if node[0] == CHANCE_ID:
+            _, key, pot, _, _, dead = node
+            children = [(c, 0, self._deal(node, c))
+                    for c in range(DECK_SIZE) if not dead >> c & 1]
+            return (CHANCE_ID, -1, pot, NOT_TERMINAL, key, children)
+
+        p, key, base, contrib, stack, n_raises, last_raise, _, street, _ = node
+        pot = base + contrib[0] + contrib[1]
+        actions = self.actions(street, pot, contrib, stack, p, n_raises,
+                last_raise)
+        children = [(a, to, self._child(node, a, to)) for (a, to) in actions]
+        return (p, p, pot, NOT_TERMINAL, key, children)
+
+    def _child(self, node, a, to) -> tuple:
+        """Return node after action a, which leaves the actor's wager at to"""
+        (p, key, base, contrib, stack, n_raises, last_raise, n_acted, street,
+                dead) = node
+        me, opp = p, 1 - p
+        key = key * HISTORY_BASE + history_digit(a)
+        if a == FOLD:
+            # uncalled chips go back
+            return (TERMINAL_ID, key, base + 2 * contrib[me],
+                    P1_FOLDED if me == PLAYER_1_ID else P2_FOLDED)
+
+        if a == CHECK and n_acted == 0:
+            return (opp, key, base, contrib, stack, 0, 0, 1, street, dead)
+        stack = list(stack)
+        stack[me] -= to - contrib[me]
+        if a in (CHECK, CALL):
+            # street is over
+            if street == RIVER:
+                return (TERMINAL_ID, key, base + 2 * to, SHOWDOWN)
+            return (CHANCE_ID, key, base + 2 * to, tuple(stack), street + 1,
+                    dead)
+
+        # bet or raise
+        if contrib[opp] > contrib[me]:
+            n_raises += 1
+        raised = to - contrib[opp]
+        contrib = list(contrib)
+        contrib[me] = to
+        return (opp, key, base, tuple(contrib), tuple(stack), n_raises,
+                raised, n_acted + 1, street, dead)
+
+    def _deal(self, node, card) -> tuple:
+        """Return node after card 0..51 is dealt at chance node"""
+        _, key, pot, stack, street, dead = node
+        key = history_card(key, card)
+        dead |= 1 << card
+        if min(stack) == 0:
+            # nobody can bet, deal the rest of the board
+            if street == RIVER:
+                return (TERMINAL_ID, key, pot, SHOWDOWN)
+            return (CHANCE_ID, key, pot, stack, street + 1, dead)
+        return (PLAYER_1_ID, key, pot, (0, 0), stack, 0, 0, 0, street, dead)
+
+
+def tree_stats(config) -> dict:
+    """
+    Return size of the game tree of config before solving: node counts,
+    infosets and bytes of the trainers' regret and strategy tables
+    """
+    tree = build_tree(config.initial_state())
+    table = InfosetTable(tree, zeros=lambda n: None)
+    decision = np.flatnonzero(tree.player >= 0)
+    chance = np.flatnonzero(tree.node_type == CHANCE_ID)
+    return {
+        'nodes': tree.n_nodes,
+        'decision_nodes': len(decision),
+        'chance_nodes': len(chance),
+        'terminal_nodes': tree.n_nodes - len(decision) - len(chance),
+        'runouts': len(tree.runout_cards),
+        'infosets': len(table),
+        'table_bytes': 2 * 8 * int(table.size),
+    }
@@ -3,64 +3,146 @@ import random
 from poker.hand import Range
 
 from state import State, PlayerState
-
-class ISet:
-    """Infoset node"""
-    def __init__(self, n_actions):
-        self.regrets = np.zeros(n_actions)
-        self.strategy_sum = np.zeros(n_actions)
-
-    def get_final_strategy(self):
-        """Get normalized strategy from strategy_sum"""
-        norm_sum = 0
-        strategy = np.zeros(len(self.strategy_sum))
-        for a in range(len(self.strategy_sum)):
-            norm_sum += max(self.strategy_sum[a], 0)
-        for a in range(len(self.strategy_sum)):
-            if norm_sum > 0:
-                strategy[a] = max(self.strategy_sum[a], 0) / norm_sum
-            else:
-                strategy[a] = 1 / len(self.strategy_sum)
-        return strategy
-
-    def get_strategy(self):
-        """Get strategy for infoset through regret matching"""
-        norm_sum = 0
-        strategy = np.zeros(len(self.regrets))
-        for a in range(len(self.regrets)):
-            norm_sum += max(self.regrets[a], 0)
-        for a in range(len(self.regrets)):
-            if norm_sum > 0:
-                strategy[a] = max(self.regrets[a], 0) / norm_sum
-            else:
-                strategy[a] = 1 / len(self.regrets)
-        return strategy
-
+from tree import build_tree, ROOT, SHOWDOWN, P1_FOLDED
+from showdown import TerminalEvaluator
+from infosets import ISet, InfosetTable, regret_matching
 
 class CFRTrainerBase:
     """Base class for different cfr variants"""
+    # allocator of arrays sized by the infoset table
+    _zeros = staticmethod(np.zeros)
+
     def __init__(self, initial_state):
         self._initial_state = initial_state
-        self._infosets = dict()
+        # betting tree is built once and traversed by node index
+        self._tree = build_tree(initial_state)
+        # regrets & strategy sums of every infoset, indexed by tree node
+        self._infosets = InfosetTable(self._tree, zeros=self._zeros)
+        # number of iterations trained so far
+        self._iterations = 0
+        # for profiling
+        self._nodes_touched = 0
+        self._terminal_evals = 0
+        self._chance_nodes = 0
+        self._telemetry = None
 
+    @property
+    def iterations(self): return self._iterations
+
+    @property
+    def telemetry(self): return self._telemetry
+
+    def set_telemetry(self, telemetry):
+        """
+        Attach a telemetry.Telemetry, called after every iteration
+        @param telemetry: Telemetry, or None to detach
+        """
+        if self._telemetry is not None:
+            self._telemetry.detach(self)
+        self._telemetry = telemetry
+        if telemetry is not None:
+            telemetry.attach(self)
 
-    def get_or_create(self, key, n_actions):
-        """Get or create infoset node"""
-        try:
-            return self._infosets[key]
-        except:
-            self._infosets[key] = ISet(n_actions)
-            return self._infosets[key]
+    def config(self) -> dict:
+        """Return constructor options, used to rebuild from a checkpoint"""
+        return dict()
+
+    def get_infoset(self, node, hands):
+        """Get infoset of acting player at tree node"""
+        return self._infosets.get(node, hands[self._tree.player[node]])
+
+    def _init_pruning(self, pruning, visit_reach):
+        """
+        @param visit_reach: typical chance reach of one infoset visit
+        """
+        self._pruning = pruning
+        # number of tree nodes skipped by pruning
+        self._nodes_pruned = 0
+        # zero probability actions with regret below this are skipped,
+        # defaults to losing the starting pot on ten visits
+        tree = self._tree
+        self._prune_regret = -10 * tree.pot[ROOT] * visit_reach
+        if not pruning: return
+
+        # regret an action could at most have gained while skipped
+        self._skipped_regret = self._zeros(self._infosets.size)
+        # best payoff each player can reach below each node when it wins,
+        # ties or loses the showdown, an upper bound on the value of a
+        # skipped subtree for a given deal
+        self._best_payoff = np.zeros((3, 2, tree.n_nodes))
+        for node in range(tree.n_nodes - 1, -1, -1):
+            if tree.is_terminal(node):
+                value = tree.pot[node] / 2.0
+                for p in [0, 1]:
+                    if tree.payoff[node] == SHOWDOWN:
+                        self._best_payoff[:, p, node] = [value, 0, -value]
+                    elif tree.payoff[node] == P1_FOLDED + p:
+                        self._best_payoff[:, p, node] = -value
+                    else:
+                        self._best_payoff[:, p, node] = value
+            else:
+                children = tree.children(node)
+                self._best_payoff[:, :, node] = self._best_payoff[
+                        :, :, children.start:children.stop].max(axis=2)
+
+    def pruned_actions(self, node, hands, iset, sigma) -> np.ndarray:
+        """
+        Return mask of actions to skip at a traverser infoset
+        an action is skipped while it has zero probability and its regret
+        stays below the threshold even if the skipped visits had paid
+        the best payoff in its subtree
+        """
+        start = self._infosets.index(node, hands[self._tree.player[node]])
+        skipped = self._skipped_regret[start:start + len(sigma)]
+        return (sigma == 0) & (iset.regrets + skipped < self._prune_regret)
+
+    def update(self, node, hands, iset, sigma, utils, util, cfr_reach,
+            pruned=None):
+        """
+        Update regrets & strategy sum of traverser infoset
+        @param pruned: mask of actions skipped this traversal, their
+            utils are not set
+        """
+        if not self._pruning:
+            iset.regrets += cfr_reach * (utils - util)
+            iset.strategy_sum += cfr_reach * sigma
+            return
+
+        tree = self._tree
+        start = self._infosets.index(node, hands[tree.player[node]])
+        skipped = self._skipped_regret[start:start + len(utils)]
+        explored = np.ones(len(utils), dtype=bool)
+        if pruned is not None:
+            player = tree.player[node]
+            ranks = tree.board_ranks(tree.runout[node])
+            score = ranks[player][hands[player]]
+            opp_score = ranks[1 - player][hands[1 - player]]
+            # 0 win, 1 tie, 2 lose, lower score is better
+            outcome = 1 + np.sign(score - opp_score)
+            if len(tree.runout_board(tree.runout[node])) < 5:
+                # cards to come, the best case is winning
+                outcome = 0
+            best = self._best_payoff[outcome, player, tree.children(node)]
+            skipped[pruned] += cfr_reach * (best[pruned] - util)
+            explored = ~pruned
+
+        # re-warm actions coming back from pruning with the regret they
+        # could have gained while skipped, so they are never starved
+        back = explored & (skipped != 0)
+        iset.regrets[back] += skipped[back]
+        skipped[back] = 0
+
+        iset.regrets[explored] += cfr_reach * (utils[explored] - util)
+        iset.strategy_sum += cfr_reach * sigma
 
 class MCCFRTrainer(CFRTrainerBase):
     """external sampling cfr implementation"""
     def __init__(self, initial_state, discount=False, pruning=False):
         super().__init__(initial_state)
-        # for profiling
-        self._nodes_touched = 0
         # options
         self._discount = discount
-        self._pruning = pruning
+        # one visit samples a single deal
+        self._init_pruning(pruning, 1 / self._tree.chance.n_pairs)
         # hyper params
         self._d_interval = 1000 # discount interval
         self._prune_threshold = 10000
@@ -69,123 +151,337 @@ class MCCFRTrainer(CFRTrainerBase):
     def discount(self):
         return self._discount
 
+    def config(self) -> dict:
+        return {'discount': self._discount, 'pruning': self._pruning}
+
     def train(self, T):
-        for t in range(1, T):
-            for player in [0, 1]:
-                if self._pruning and t > self._prune_threshold:
-                    q = random.uniform(0, 1)
-                    if q < 0.05: # 5% of the time, don't prune
-                        self.mccfr(self._initial_state, player, 1)
-                    else:
-                        self.mccfr(self._initial_state, player, 1, prune=True)
-                else:
-                    self.mccfr(self._initial_state, player, 1)
+        """
+        Run T - 1 more iterations
+        @param T: iteration count
+        """
+        start = self._iterations + 1
+        for t in range(start, start + T - 1):
+            self.iteration(t)
+            self._iterations = t
 
             if self.discount:
                 # perform discounting
                 if t % self._d_interval == 0:
-                    # discount factor
-                    d = (t / self._d_interval) / ((t / self._d_interval) + 1)
-                    for k in self._infosets:
-                        self._infosets[k].regrets *= d
-                        self._infosets[k].strategy_sum *= d
+                    self.apply_discount(t)
+
+            if self._telemetry is not None \
+                    and self._telemetry.on_iteration(self):
+                break
+
+    def iteration(self, t):
+        """Run one sampled traversal per player for iteration t"""
+        for player in [0, 1]:
+            if self._pruning and t > self._prune_threshold:
+                q = random.uniform(0, 1)
+                if q < 0.05: # 5% of the time, don't prune
+                    self.sample_deal(player)
+                else:
+                    self.sample_deal(player, prune=True)
+            else:
+                self.sample_deal(player)
+
+    def apply_discount(self, t):
+        # discount factor
+        d = (t / self._d_interval) / ((t / self._d_interval) + 1)
+        self._infosets.discount(d)
+
+    def sample_deal(self, player, prune=False) -> float:
+        """Sample one chance outcome for both hands and traverse"""
+        chance = self._tree.chance
+        hands, _ = chance.sample()
+        # deals are already sampled by their probability, weighting the
+        # sample by it too would count combo weights twice, so every
+        # sample gets the mean chance reach
+        return self.mccfr(ROOT, hands, player, 1 / chance.n_pairs,
+                prune=prune)
+
+    def sample_card(self, node, hands) -> (int, tuple):
+        """
+        Sample a card not in hands at chance node, return the child
+        dealing it and hands as seen in the child's subtree
+        """
+        tree = self._tree
+        children = tree.children(node)
+        perms = tree.deal_perms[children.start:children.stop]
+        # every card a child stands for, so merged cards are dealt as
+        # often as the cards they stand for
+        cards = np.flatnonzero(perms.ravel() >= 0)
+        while True:
+            i = cards[random.randrange(len(cards))]
+            child = children[i // perms.shape[1]]
+            dealt = tree.deal_hands(child, hands)[i % perms.shape[1]]
+            card = tree.action[child]
+            if tree.unblocked[0][card, dealt[0]] \
+                    and tree.unblocked[1][card, dealt[1]]:
+                return child, dealt
 
-    def mccfr(self, state, player, cfr_reach, prune=False) -> float:
+    def mccfr(self, node, hands, player, cfr_reach, prune=False) -> float:
+        tree = self._tree
         self._nodes_touched += 1
-        if state.is_terminal:
-            return state.get_utility()[player]
-        if state.is_chance:
-            # sample one chance outcome
-            chances = state.legal_actions
-            chance_prob = 1 / len(chances)
-            child_state = state.apply_action(random.choice(chances))
-            return self.mccfr(child_state, player, cfr_reach * chance_prob)
-
-        actions = state.legal_actions
-        iset = self.get_or_create(state.infoset_str(state.current), len(actions))
+        if tree.is_terminal(node):
+            self._terminal_evals += 1
+            return tree.utility(node, hands)[player]
+
+        if tree.is_chance(node):
+            self._chance_nodes += 1
+            # sample a public card not held by either hand
+            child, hands = self.sample_card(node, hands)
+            return self.mccfr(child, hands, player, cfr_reach, prune)
+
+        children = tree.children(node)
+        iset = self.get_infoset(node, hands)
         sigma = iset.get_strategy()
 
-        if state.current == player:
+        if tree.player[node] == player:
+            pruned = self.pruned_actions(node, hands, iset, sigma) if prune else None
             util = 0
-            utils = np.zeros(len(actions))
-            for (i, action) in enumerate(actions):
-                child_state = state.apply_action(action)
-                utils[i] = self.mccfr(child_state, player, cfr_reach)
+            utils = np.zeros(len(children))
+            for (i, child) in enumerate(children):
+                if prune and pruned[i]:
+                    self._nodes_pruned += tree.subtree_size[child]
+                    continue
+                utils[i] = self.mccfr(child, hands, player, cfr_reach, prune)
                 util += utils[i] * sigma[i]
 
-            # update regrets & strategy sum
-            for (i, _) in enumerate(actions):
-                iset.regrets[i] += cfr_reach * (utils[i] - util)
-                iset.strategy_sum[i] += cfr_reach * sigma[i]
-
+            self.update(node, hands, iset, sigma, utils, util, cfr_reach,
+                    pruned)
             return util
 
         else: # sample a single action
-            a_idx = np.random.choice(list(range(len(actions))), 1, p=sigma)[0]
-            child_state = state.apply_action(actions[a_idx])
+            a_idx = np.random.choice(list(range(len(children))), 1, p=sigma)[0]
             child_cfr_reach = sigma[a_idx] * cfr_reach
 
-            return self.mccfr(child_state, player, child_cfr_reach)
+            return self.mccfr(children[a_idx], hands, player, child_cfr_reach,
+                    prune)
 
 
 class CFRTrainer(CFRTrainerBase):
     """vanilla cfr implementation"""
-    def __init__(self, initial_state):
+    def __init__(self, initial_state, pruning=False):
         super().__init__(initial_state)
-        # for profiling
-        self._nodes_touched = 0
+        # options, one visit covers every deal of a p1 hand
+        self._init_pruning(pruning, 1 / len(self._tree.chance.valid[0]))
+        # hyper params
+        self._prune_threshold = 10
+
+    def config(self) -> dict:
+        return {'pruning': self._pruning}
 
     def train(self, T):
         """
+        Run T - 1 more iterations
         @param T: iteration count
         """
-        for t in range(1, T):
+        tree = self._tree
+        start = self._iterations + 1
+        for t in range(start, start + T - 1):
+            self._iterations = t
             for player in [0, 1]:
-                self.cfr(self._initial_state, player, 1)
+                prune = self._pruning and t > self._prune_threshold
+                if prune and random.uniform(0, 1) < 0.05:
+                    prune = False # 5% of the time, don't prune
+                # enumerate all chance outcomes
+                chance = tree.chance
+                for (i, hands) in enumerate(chance.pairs):
+                    self.cfr(ROOT, hands, player, chance.pair_prob[i], prune)
 
-    def cfr(self, state, player, cfr_reach) -> float:
+            if self._telemetry is not None \
+                    and self._telemetry.on_iteration(self):
+                break
+
+    def cfr(self, node, hands, player, cfr_reach, prune=False) -> float:
         """Recursive cfr function
-            @param state: current state value
+            @param node: index of current node in game tree
+            @param hands: (p1, p2) range index of dealt hands
             @param player: index of player (0 or 1)
             @param cfr_reach: counter-factual probability of reaching current state
+            @param prune: skip negative regret actions and unreachable subtrees
             @return utility: ev of node
         """
+        tree = self._tree
         self._nodes_touched += 1
-        if state.is_terminal:
-            return state.get_utility()[player]
-        if state.is_chance:
+        if tree.is_terminal(node):
+            self._terminal_evals += 1
+            return tree.utility(node, hands)[player]
+
+        if tree.is_chance(node):
+            self._chance_nodes += 1
+            # every public card not held by either hand
             util = 0
-            # get all chance outcomes
-            actions = state.legal_actions
-            # assign equal probability to each action
-            cfr_reach /= len(state.legal_actions)
-            for c in actions:
-                child_state = state.apply_action(c)
-                util += self.cfr(child_state, player, cfr_reach)
+            for child in tree.children(node):
+                card = tree.action[child]
+                prob = tree.deal_prob[child]
+                for dealt in tree.deal_hands(child, hands):
+                    if not (tree.unblocked[0][card, dealt[0]]
+                            and tree.unblocked[1][card, dealt[1]]):
+                        continue
+                    util += prob * self.cfr(child, dealt, player,
+                            cfr_reach * prob, prune)
             return util
 
-        actions = state.legal_actions
-        iset = self.get_or_create(state.infoset_str(state.current), len(actions))
+        children = tree.children(node)
+        iset = self.get_infoset(node, hands)
         # get strategy by regret matching
         sigma = iset.get_strategy()
+        pruned = None
+        if prune and tree.player[node] == player:
+            pruned = self.pruned_actions(node, hands, iset, sigma)
         util = 0
-        utils = np.zeros(len(actions))
-        for (i, action) in enumerate(actions):
-            child_state = state.apply_action(action)
+        utils = np.zeros(len(children))
+        for (i, child) in enumerate(children):
             # update reach probs
             child_cfr_reach = cfr_reach
-            if state.current != player:
+            if tree.player[node] != player:
                 child_cfr_reach *= sigma[i]
-            utils[i] = self.cfr(child_state, player, child_cfr_reach)
+            if prune and (child_cfr_reach == 0 or
+                    (pruned is not None and pruned[i])):
+                self._nodes_pruned += tree.subtree_size[child]
+                continue
+            utils[i] = self.cfr(child, hands, player, child_cfr_reach, prune)
             util += utils[i] * sigma[i]
 
         # if not doing simultanuous updates
-        if state.current != player:
+        if tree.player[node] != player:
             return util
 
+        self.update(node, hands, iset, sigma, utils, util, cfr_reach, pruned)
+        return util
+
+
+class VectorCFRTrainer(CFRTrainerBase):
+    """
+    range vs range cfr implementation
+    walks the public tree once per iteration carrying a reach probability
+    vector over each player's range, instead of one walk per dealt pair
+    """
+    def __init__(self, initial_state):
+        super().__init__(initial_state)
+        self._strategy_weight = 1.0
+        self._terminals = TerminalEvaluator(self._tree)
+        self._initial_reach = self._terminals.initial_reach
+
+    def get_strategy(self, node):
+        """Get (n_hands x n_actions) strategy through regret matching"""
+        return regret_matching(self._infosets.node_regrets(node))
+
+    def train(self, T):
+        """
+        @param T: iteration count
+        """
+        for t in range(1, T):
+            self.iteration()
+            if self._telemetry is not None \
+                    and self._telemetry.on_iteration(self):
+                break
+
+    def iteration(self):
+        """Run one iteration, updating player 1 then player 2"""
+        self._iterations += 1
+        self._strategy_weight = self.strategy_weight(self._iterations)
+        for player in [0, 1]:
+            self.cfr(ROOT, player, list(self._initial_reach))
+
+    def strategy_weight(self, t) -> float:
+        """Weight of iteration t's strategy in the average strategy"""
+        return 1.0
+
+    def cfr(self, node, player, reach) -> np.ndarray:
+        """Recursive vectorized cfr function
+            @param node: index of current public node in game tree
+            @param player: index of updating player (0 or 1)
+            @param reach: [p1, p2] reach probability vectors over ranges
+            @return utility: counterfactual value of each hand of player
+        """
+        tree = self._tree
+        self._nodes_touched += 1
+        if tree.is_terminal(node):
+            self._terminal_evals += 1
+            return self._terminals.values(node, player, reach[1 - player])
+
+        if tree.is_chance(node):
+            self._chance_nodes += 1
+            # deal each public card, hands holding it drop out
+            util = 0
+            for child in tree.children(node):
+                unblocked = [u[tree.action[child]] for u in tree.unblocked]
+                child_reach = [reach[0] * unblocked[0], reach[1] * unblocked[1]]
+                util = util + tree.deal_values(child, player,
+                        tree.deal_prob[child] * unblocked[player]
+                        * self.cfr(child, player, child_reach))
+            return util
+
+        current = tree.player[node]
+        children = tree.children(node)
+        table = self._infosets
+        sigma = table.hand_view(node, self.get_strategy(node))
+
+        if current != player:
+            util = 0
+            for (i, child) in enumerate(children):
+                child_reach = list(reach)
+                child_reach[current] = reach[current] * sigma[:, i]
+                util = util + self.cfr(child, player, child_reach)
+            return util
+
+        utils = np.zeros(sigma.shape)
+        for (i, child) in enumerate(children):
+            utils[:, i] = self.cfr(child, player, reach)
+        util = (utils * sigma).sum(axis=1)
+
         # update regrets & strategy sum
-        for (i, _) in enumerate(actions):
-            iset.regrets[i] += cfr_reach * (utils[i] - util)
-            iset.strategy_sum[i] += cfr_reach * sigma[i]
+        table.accumulate(node, table.node_regrets(node), utils - util[:, None])
+        table.accumulate(node, table.node_strategy_sum(node),
+                self._strategy_weight * reach[player][:, None] * sigma)
 
         return util
+
+
+class CFRPlusTrainer(VectorCFRTrainer):
+    """
+    cfr+ implementation
+    regrets are floored at zero, updates alternate between players and
+    the average strategy weighs iteration t by max(t - delay, 0)
+    """
+    def __init__(self, initial_state, delay=0):
+        super().__init__(initial_state)
+        self._delay = delay
+
+    def config(self) -> dict:
+        return {'delay': self._delay}
+
+    def get_strategy(self, node):
+        """Get strategy from regrets floored at zero"""
+        return regret_matching(self._infosets.node_regrets(node), plus=True)
+
+    def strategy_weight(self, t) -> float:
+        return max(t - self._delay, 0)
+
+
+class DCFRTrainer(VectorCFRTrainer):
+    """
+    discounted cfr implementation
+    after iteration t positive regrets are scaled by t^a / (t^a + 1),
+    negative regrets by t^b / (t^b + 1) and the strategy sum by
+    (t / (t + 1))^g, updates alternate between players
+    """
+    def __init__(self, initial_state, alpha=1.5, beta=0, gamma=2):
+        super().__init__(initial_state)
+        self._alpha = alpha
+        self._beta = beta
+        self._gamma = gamma
+
+    def config(self) -> dict:
+        return {'alpha': self._alpha, 'beta': self._beta, 'gamma': self._gamma}
+
+    def iteration(self):
+        super().iteration()
+        t = self._iterations
+        self._infosets.discount(
+                t ** self._alpha / (t ** self._alpha + 1),
+                (t / (t + 1)) ** self._gamma,
+                negative_factor=t ** self._beta / (t ** self._beta + 1))
@@ -0,0 +1,189 @@
+"""
+Save and resume trainer state
+
+A checkpoint is a directory holding one .npy file per array and a
+meta.json index with the trainer class, its options, counters, board,
+ranges and rng state. Arrays can be memory mapped when loading, so a
+large solved strategy opens instantly and is only read where it is used.
+
+    save_checkpoint(trainer, 'solve.ckpt')
+    trainer = load_checkpoint('solve.ckpt')
+    trainer = load_checkpoint('solve.ckpt', mmap_mode='r') # read only
+"""
+import json
+import os
+import random
+import shutil
+
+import numpy as np
+from treys import Card
+
+from state import State, GameConfig
+from betting import BetSizing
+from abstraction import CardAbstraction
+from cfr import (CFRTrainer, MCCFRTrainer, VectorCFRTrainer, CFRPlusTrainer,
+        DCFRTrainer)
+from parallel import ParallelMCCFRTrainer
+
+FORMAT_VERSION = 2
+
+TRAINERS = {cls.__name__: cls for cls in [CFRTrainer, MCCFRTrainer,
+    ParallelMCCFRTrainer, VectorCFRTrainer, CFRPlusTrainer, DCFRTrainer]}
+
+# counters restored as is, when the trainer has them
+_COUNTERS = ['_iterations', '_nodes_touched', '_terminal_evals',
+        '_chance_nodes', '_nodes_pruned']
+
+
+def _cards_to_str(cards):
+    return [Card.int_to_str(c) for c in cards]
+
+def _cards_from_str(cards):
+    return [Card.new(c) for c in cards]
+
+
+def save_checkpoint(trainer, path):
+    """
+    Write trainer state to directory path, replacing it atomically
+    @param trainer: any trainer in TRAINERS
+    """
+    config = trainer._initial_state.config
+    table = trainer._infosets
+    np_rng = np.random.get_state()
+    py_rng = random.getstate()
+    meta = {
+        'version': FORMAT_VERSION,
+        'trainer': type(trainer).__name__,
+        'config': trainer.config(),
+        'counters': {name: int(getattr(trainer, name))
+            for name in _COUNTERS if hasattr(trainer, name)},
+        'game': {
+            'board': _cards_to_str(config.board),
+            'ranges': [[_cards_to_str(c) for c in r] for r in config.ranges],
+            'weights': [w.tolist() for w in config.weights],
+            'stack': config.stack,
+            'pot': config.pot,
+            'street': config.street,
+            'betting': None if config.betting is None
+                else config.betting.to_dict(),
+            'isomorphism': config.isomorphism,
+            'abstraction': None if config.abstraction is None
+                else config.abstraction.to_dict(),
+        },
+        'size': int(table.size),
+        'rng': {
+            'python': [py_rng[0], list(py_rng[1]), py_rng[2]],
+            'numpy': [np_rng[0], int(np_rng[2]), int(np_rng[3]),
+                float(np_rng[4])],
+        },
+    }
+    arrays = {
+        'regrets': table.regrets,
+        'strategy_sum': table.strategy_sum,
+        'rng_keys': np_rng[1],
+    }
+    if getattr(trainer, '_pruning', False):
+        arrays['skipped_regret'] = trainer._skipped_regret
+
+    # write next to path then swap, so a crash never leaves half a checkpoint
+    path = os.path.abspath(path)
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for (name, array) in arrays.items():
+        np.save(os.path.join(tmp, name + '.npy'), np.asarray(array))
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    old = path + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def initial_state_of(meta) -> State:
+    """Return initial state for the game config of a checkpoint"""
+    game = meta['game']
+    ranges = [[tuple(_cards_from_str(c)) for c in r] for r in game['ranges']]
+    betting = None
+    if game['betting'] is not None:
+        betting = BetSizing.from_dict(game['betting'])
+    abstraction = None
+    if game.get('abstraction') is not None:
+        abstraction = CardAbstraction.from_dict(game['abstraction'])
+    config = GameConfig(_cards_from_str(game['board']), *ranges,
+            weights=game['weights'], stack=game['stack'], pot=game['pot'],
+            street=game['street'], betting=betting,
+            isomorphism=game.get('isomorphism', False),
+            abstraction=abstraction)
+    return config.initial_state()
+
+
+def load_checkpoint(path, mmap_mode=None, restore_rng=True):
+    """
+    Rebuild trainer saved in directory path
+    @param mmap_mode: None to copy arrays into the trainer's own table,
+        'r' to map them read only, e.g. to query or evaluate a strategy,
+        'c' to map them copy on write
+    @param restore_rng: reset the global rngs to their saved state
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != FORMAT_VERSION:
+        raise ValueError(f"unsupported checkpoint version {meta['version']}")
+
+    cls = TRAINERS[meta['trainer']]
+    trainer = cls.__new__(cls)
+    if mmap_mode is not None:
+        # the arrays are mapped below, don't allocate zeros for them first
+        trainer._zeros = lambda n: None
+    trainer.__init__(initial_state_of(meta), **meta['config'])
+    table = trainer._infosets
+    if table.size != meta['size']:
+        raise ValueError('checkpoint does not match the rebuilt game tree')
+
+    def load(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+
+    if mmap_mode is None:
+        # copy, keeps tables allocated in shared memory shared
+        table.regrets[:] = load('regrets')
+        table.strategy_sum[:] = load('strategy_sum')
+    else:
+        table.regrets = load('regrets')
+        table.strategy_sum = load('strategy_sum')
+    if getattr(trainer, '_pruning', False):
+        if mmap_mode is None:
+            # copy in place, keeps a shared array shared
+            trainer._skipped_regret[:] = load('skipped_regret')
+        else:
+            trainer._skipped_regret = load('skipped_regret')
+
+    for (name, value) in meta['counters'].items():
+        setattr(trainer, name, value)
+
+    if restore_rng:
+        version, internal, gauss = meta['rng']['python']
+        random.setstate((version, tuple(internal), gauss))
+        kind, pos, has_gauss, cached = meta['rng']['numpy']
+        np.random.set_state(
+                (kind, np.load(os.path.join(path, 'rng_keys.npy')), pos,
+                    has_gauss, cached))
+    return trainer
+
+
+def train_with_checkpoints(trainer, T, path, every):
+    """
+    Run T - 1 iterations, saving a checkpoint every `every` iterations
+    and once at the end
+    """
+    remaining = T - 1
+    while remaining > 0:
+        n = min(every, remaining)
+        # train(T) runs T - 1 iterations
+        trainer.train(n + 1)
+        remaining -= n
+        save_checkpoint(trainer, path)
+    return trainer
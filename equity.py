@@ -0,0 +1,221 @@
+"""
+Hand strength and equity tables per board
+
+Everything here works on the space of all 1326 two card combos, combo i
+is COMBOS[i], a pair of card indexes 0..51 of state.CARD_INDEX, so a
+table computed for one board serves every range solved on it. A range is
+mapped into the space with combo_index.
+
+    hand_ranks(board)             treys score of every combo
+    showdown_equity(board, w)     river equity of every combo against a
+                                  weighted range, w over the 1326 combos
+    equity(board, w)              all in equity, averaged over every
+                                  runout of a 3 or 4 card board
+
+Tables are computed once per suit isomorphic board, on its canonical
+board from isomorphism.canonical, and relabeled for the others. Returned
+arrays are shared, read only.
+"""
+import functools
+import itertools
+
+import numpy as np
+
+from state import CARD_INDEX, INDEX_CARD, DECK_SIZE, range_cards, _range_table
+from isomorphism import SUIT_PERMS, canonical, permute_cards
+from handeval import default_evaluator
+
+N_COMBOS = DECK_SIZE * (DECK_SIZE - 1) // 2
+
+# combo index -> (card, card), lower card first
+COMBOS = np.array(list(itertools.combinations(range(DECK_SIZE), 2)),
+        dtype=np.int64)
+# (card, card) -> combo index, either order, -1 on the diagonal
+COMBO_INDEX = np.full((DECK_SIZE, DECK_SIZE), -1, dtype=np.int64)
+COMBO_INDEX[COMBOS[:, 0], COMBOS[:, 1]] = np.arange(N_COMBOS)
+COMBO_INDEX[COMBOS[:, 1], COMBOS[:, 0]] = np.arange(N_COMBOS)
+# (52 x 51) combos holding each card
+CARD_COMBOS = np.array([[COMBO_INDEX[c, o] for o in range(DECK_SIZE) if o != c]
+        for c in range(DECK_SIZE)], dtype=np.int64)
+# perm id -> combo index of each relabeled combo
+COMBO_PERMS = np.array([[COMBO_INDEX[permute_cards(combo, p)]
+        for combo in COMBOS] for p in range(len(SUIT_PERMS))], dtype=np.int64)
+
+# boards whose tables are kept, per table kind
+CACHED_BOARDS = 4096
+
+
+def combo_index(combos) -> np.ndarray:
+    """Return index of each combo of a range, cached per range"""
+    return _range_table(combos, 'combo_index', lambda combos: COMBO_INDEX[
+        tuple(range_cards(combos).T)])
+
+
+def full_weights(combos, weights) -> np.ndarray:
+    """Return weights of a range over all 1326 combos, 0 outside it"""
+    full = np.zeros(N_COMBOS)
+    full[combo_index(combos)] = weights
+    return full
+
+
+def board_blocked(board) -> np.ndarray:
+    """Return mask of combos holding a card of board, treys cards"""
+    blocked = np.zeros(N_COMBOS, dtype=bool)
+    for c in board:
+        blocked[CARD_COMBOS[CARD_INDEX[c]]] = True
+    return blocked
+
+
+def _canonical(board) -> (tuple, int):
+    """Return canonical card indexes of treys board and the perm to them"""
+    cards, _, perm = canonical([CARD_INDEX[c] for c in board])
+    return cards, perm
+
+
+def _readonly(array) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+@functools.lru_cache(maxsize=CACHED_BOARDS)
+def _canonical_ranks(cards) -> np.ndarray:
+    ranks = np.zeros(N_COMBOS, dtype=np.int64)
+    live = ~board_blocked([INDEX_CARD[c] for c in cards])
+    # every combo in one batch
+    ranks[live] = default_evaluator().evaluate_hands(cards, COMBOS[live])
+    return _readonly(ranks)
+
+
+def hand_ranks(board) -> np.ndarray:
+    """
+    Return treys score of every combo on a 3 to 5 card board, lower is
+    better, 0 for combos holding a board card, which are never dealt
+    @param board: list of treys cards
+    """
+    cards, perm = _canonical(board)
+    # a combo scores on board what its relabeling scores on the canonical
+    return _readonly(_canonical_ranks(cards)[COMBO_PERMS[perm]])
+
+
+def range_ranks(board, combos) -> np.ndarray:
+    """Return treys score of each combo of a range on board"""
+    return hand_ranks(board)[combo_index(combos)]
+
+
+def _sorted_prefix(ranks, weights):
+    """
+    Return sorted ranks of each row and the prefix sums of weights in that
+    order, rows offset by row * 2**16 so one searchsorted covers them all
+    """
+    order = np.argsort(ranks, axis=-1, kind='stable')
+    offset = (np.arange(ranks.shape[0]) << 16)[:, None]
+    keys = (np.take_along_axis(ranks, order, axis=-1) + offset).ravel()
+    prefix = np.zeros(keys.size + 1)
+    np.cumsum(np.take_along_axis(weights, order, axis=-1), out=prefix[1:])
+    return keys, prefix
+
+
+def showdown_weights(ranks, weights) -> (np.ndarray, np.ndarray,
+        np.ndarray):
+    """
+    Return (win, tie, total) opponent weight of every combo at showdown,
+    counting only opponent combos sharing no card with it
+    @param ranks: score of every combo, lower is better
+    @param weights: opponent weight of every combo, 0 for combos holding
+        a board card
+    """
+    # whole space, then the combos holding each card of the hand, which
+    # were counted but can't be dealt with it
+    keys, prefix = _sorted_prefix(ranks[None, :], weights[None, :])
+    better = prefix[np.searchsorted(keys, ranks, side='left')]
+    not_worse = prefix[np.searchsorted(keys, ranks, side='right')]
+    total = np.full(N_COMBOS, prefix[-1])
+
+    card_keys, card_prefix = _sorted_prefix(ranks[CARD_COMBOS],
+            weights[CARD_COMBOS])
+    n = CARD_COMBOS.shape[1]
+    for card in COMBOS.T:
+        hand_keys = (card << 16) + ranks
+        # prefix index where the card's row starts
+        start = card * n
+        better -= card_prefix[np.searchsorted(card_keys, hand_keys,
+            side='left')] - card_prefix[start]
+        not_worse -= card_prefix[np.searchsorted(card_keys, hand_keys,
+            side='right')] - card_prefix[start]
+        total -= card_prefix[start + n] - card_prefix[start]
+    # the combo itself holds both cards, removed twice, and ties itself
+    not_worse += weights
+    total += weights
+    return total - not_worse, not_worse - better, total
+
+
+def _equity(win, tie, total) -> np.ndarray:
+    """Return (win + tie / 2) / total, nan where total is 0"""
+    equity = np.full(N_COMBOS, np.nan)
+    np.divide(win + 0.5 * tie, total, out=equity, where=total > 0)
+    return equity
+
+
+def _canonical_weights(weights, perm) -> np.ndarray:
+    """Return weights relabeled by perm"""
+    relabeled = np.empty(N_COMBOS)
+    relabeled[COMBO_PERMS[perm]] = weights
+    return relabeled
+
+
+@functools.lru_cache(maxsize=CACHED_BOARDS)
+def _canonical_showdown_equity(cards, weights) -> np.ndarray:
+    weights = np.frombuffer(weights)
+    ranks = _canonical_ranks(cards)
+    blocked = board_blocked([INDEX_CARD[c] for c in cards])
+    equity = _equity(*showdown_weights(ranks, np.where(blocked, 0, weights)))
+    equity[blocked] = np.nan
+    return _readonly(equity)
+
+
+def showdown_equity(board, weights) -> np.ndarray:
+    """
+    Return showdown equity of every combo on a 5 card board against a
+    weighted range, nan for combos holding a board card or with no
+    opponent combo to face
+    @param weights: opponent weight of every combo, see full_weights
+    """
+    cards, perm = _canonical(board)
+    relabeled = _canonical_weights(np.asarray(weights, dtype=np.float64), perm)
+    equity = _canonical_showdown_equity(cards, relabeled.tobytes())
+    return _readonly(equity[COMBO_PERMS[perm]])
+
+
+@functools.lru_cache(maxsize=CACHED_BOARDS)
+def _canonical_equity(cards, weights) -> np.ndarray:
+    weights = np.frombuffer(weights)
+    blocked = board_blocked([INDEX_CARD[c] for c in cards])
+    weights = np.where(blocked, 0, weights)
+    # sum win and tie weight over the runouts, each opponent combo is
+    # dealt with every runout it doesn't block
+    sums = np.zeros((3, N_COMBOS))
+    deck = [c for c in range(DECK_SIZE) if c not in cards]
+    for runout in itertools.combinations(deck, 5 - len(cards)):
+        river = [INDEX_CARD[c] for c in cards + runout]
+        live = ~board_blocked(river[len(cards):])
+        sums += np.where(live, showdown_weights(hand_ranks(river),
+            np.where(live, weights, 0)), 0)
+    equity = _equity(*sums)
+    equity[blocked] = np.nan
+    return _readonly(equity)
+
+
+def equity(board, weights) -> np.ndarray:
+    """
+    Return all in equity of every combo on a 3 to 5 card board against a
+    weighted range, every runout dealt with its probability given both
+    hands, nan for combos holding a board card
+    @param weights: opponent weight of every combo, see full_weights
+    """
+    cards, perm = _canonical(board)
+    relabeled = _canonical_weights(np.asarray(weights, dtype=np.float64), perm)
+    if len(cards) == 5:
+        equity = _canonical_showdown_equity(cards, relabeled.tobytes())
+    else:
+        equity = _canonical_equity(cards, relabeled.tobytes())
+    return _readonly(equity[COMBO_PERMS[perm]])
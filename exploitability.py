@@ -1,4 +1,6 @@
 from best_response import BestResponsePolicy
+from showdown import TerminalEvaluator
+from tree import ROOT
 
     # def _state_values(self, state) -> (float, float):
     #     """get value of playing on strategy"""
@@ -18,9 +20,19 @@ from best_response import BestResponsePolicy
 
 def exploitability(trainer):
     """Returns exploitability of cfr trainer strategy"""
+    # vectorized trainers already hold one
+    terminals = getattr(trainer, '_terminals', None)
+    if terminals is None:
+        terminals = TerminalEvaluator(trainer._tree)
     nash_conv = sum(
-            BestResponsePolicy(i, trainer).value(
-                trainer._initial_state) for i in [0, 1])
+            BestResponsePolicy(i, trainer, terminals).value() for i in [0, 1])
     return nash_conv / 2 # num players
 
-
+def exploitability_report(trainer) -> dict:
+    """
+    Returns exploitability in chips and in mbb/pot, thousandths of the
+    starting pot
+    """
+    chips = float(exploitability(trainer))
+    pot = trainer._tree.pot[ROOT]
+    return {'chips': chips, 'mbb_per_pot': 1000 * chips / float(pot)}
@@ -0,0 +1,279 @@
+"""
+Lookup table hand evaluator
+
+Scores whole arrays of 5 to 7 card hands with a few numpy calls, giving
+the same scores as treys' Evaluator.evaluate, lower is better. Cards are
+indexes 0..51 of state.CARD_INDEX, 4 * rank + suit with rank 0 a deuce.
+
+A hand's best non flush 5 cards only depend on how many cards of each
+rank it holds, so every multiset of 5 to 7 ranks is scored once, keyed by
+its rank counts in base 5, and stored in a table indexed by a perfect hash
+of the key. A flush needs 5 cards of one suit, only one suit can have that
+many in 7 cards, and its best 5 cards only depend on the ranks held in
+that suit, looked up by their 13 bit mask. The score of a hand is the
+better of the two. Rank and suit counts are summed in one pass over the
+cards, so a hand costs one gather and sum plus two small table lookups.
+
+Tables are built from treys' own 5 card tables once, in a few seconds,
+and saved as .npy files that later processes memory map.
+
+    evaluator = default_evaluator()
+    evaluator.evaluate(cards)           # (..., k) card indexes
+    evaluator.evaluate_hands(board, hole_cards)
+
+Check the tables against treys on seeded random hands and time them:
+
+    python handeval.py --hands 30000
+"""
+import argparse
+import itertools
+import os
+import shutil
+import sys
+import time
+from functools import reduce
+
+import numpy as np
+from treys import Card, Evaluator
+
+TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        'eval_tables')
+
+N_RANKS = 13
+# score of a hand without a flush, worse than any treys score
+NO_FLUSH = 7463
+# weight of one card of each rank in a rank count key
+_RANK_KEYS = 5 ** np.arange(N_RANKS, dtype=np.int64)
+# per card, its rank key plus its suit counted in 3 bits per suit above
+# bit 32, rank keys of 7 cards stay below 2**31
+_CARD_KEYS = np.array([_RANK_KEYS[c >> 2] + (1 << (32 + 3 * (c & 3)))
+        for c in range(52)], dtype=np.int64)
+# suit counts -> suit with 5 or more cards, -1 for none
+_FLUSH_SUIT = np.full(1 << 12, -1, dtype=np.int64)
+for counts in itertools.product(range(8), repeat=4):
+    if max(counts) >= 5 and sum(counts) <= 7:
+        _FLUSH_SUIT[sum(n << (3 * s) for (s, n) in enumerate(counts))] = \
+                counts.index(max(counts))
+
+# perfect hash of rank keys: bucket from the high bits of a multiplicative
+# hash, slot from its low bits displaced by the bucket's offset
+_HASH_MULT = 0x9E3779B1
+_BUCKET_BITS = 14
+_SLOT_BITS = 17
+
+
+def _best(lookup, ranks) -> int:
+    """Return best score of any 5 of ranks in a treys prime product table"""
+    return min(lookup[reduce(int.__mul__, (Card.PRIMES[r] for r in five))]
+            for five in itertools.combinations(ranks, 5))
+
+
+def _hash(keys) -> (np.ndarray, np.ndarray):
+    """Return (bucket, undisplaced slot) of rank keys"""
+    h = (keys * _HASH_MULT) & 0xFFFFFFFF
+    return h >> (32 - _BUCKET_BITS), h & ((1 << _SLOT_BITS) - 1)
+
+
+def _displacements(keys) -> (np.ndarray, np.ndarray):
+    """
+    Return offset of each bucket placing every key in its own slot, and
+    the slot of each key, buckets are placed largest first
+    """
+    bucket, base = _hash(keys)
+    n_slots = 1 << _SLOT_BITS
+    occupied = np.zeros(n_slots, dtype=bool)
+    offsets = np.zeros(1 << _BUCKET_BITS, dtype=np.int64)
+    slots = np.empty(len(keys), dtype=np.int64)
+    members = dict()
+    for (i, b) in enumerate(bucket):
+        members.setdefault(int(b), []).append(i)
+    for (b, keys_of) in sorted(members.items(), key=lambda m: -len(m[1])):
+        for offset in range(n_slots):
+            placed = (base[keys_of] + offset) & (n_slots - 1)
+            if not occupied[placed].any() \
+                    and len(np.unique(placed)) == len(placed):
+                break
+        else:
+            raise ValueError('rank keys have no perfect hash')
+        occupied[placed] = True
+        offsets[b] = offset
+        slots[keys_of] = placed
+    return offsets, slots
+
+
+def build_tables() -> dict:
+    """Return flush, hash offset and score tables of every 5 to 7 card hand"""
+    table = Evaluator().table
+    flush = np.full(1 << N_RANKS, NO_FLUSH, dtype=np.int16)
+    keys, scores = [], []
+    for n in [5, 6, 7]:
+        for ranks in itertools.combinations(range(N_RANKS), n):
+            mask = sum(1 << r for r in ranks)
+            flush[mask] = _best(table.flush_lookup, ranks)
+        for ranks in itertools.combinations_with_replacement(
+                range(N_RANKS), n):
+            # at most 4 cards of a rank
+            if any(ranks[i] == ranks[i + 4] for i in range(n - 4)): continue
+            keys.append(int(_RANK_KEYS[list(ranks)].sum()))
+            scores.append(_best(table.unsuited_lookup, ranks))
+    offsets, slots = _displacements(np.array(keys, dtype=np.int64))
+    table = np.zeros(1 << _SLOT_BITS, dtype=np.int16)
+    table[slots] = scores
+    return {'flush': flush, 'offsets': offsets, 'scores': table}
+
+
+def save_tables(tables, path):
+    """Write tables to directory path, replacing it atomically"""
+    path = os.path.abspath(path)
+    tmp = path + '.tmp.' + str(os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for (name, array) in tables.items():
+        np.save(os.path.join(tmp, name + '.npy'), array)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # another process saved them first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+class LookupEvaluator:
+    """Vectorized evaluator over memory mapped lookup tables"""
+    def __init__(self, path=TABLE_DIR, mmap_mode='r'):
+        """
+        @param path: directory of the tables, built and saved there if
+            missing, kept in memory if it can't be written, None to build
+            them in memory
+        @param mmap_mode: mode to map the saved tables with, None to load
+        """
+        tables = None
+        if path is None:
+            tables = build_tables()
+        elif not os.path.exists(os.path.join(path, 'scores.npy')):
+            tables = build_tables()
+            try:
+                save_tables(tables, path)
+                # map the saved tables, as later processes will
+                tables = None
+            except OSError:
+                # e.g. a read only checkout or install
+                pass
+        if tables is None:
+            tables = {name: np.load(os.path.join(path, name + '.npy'),
+                mmap_mode=mmap_mode) for name in ['flush', 'offsets', 'scores']}
+        self._flush = tables['flush']
+        self._offsets = tables['offsets']
+        self._scores = tables['scores']
+
+    def evaluate(self, cards) -> np.ndarray:
+        """
+        Return treys score of each hand
+        @param cards: (..., k) array of card indexes, 5 <= k <= 7
+        """
+        cards = np.asarray(cards, dtype=np.int64)
+        # one row per hand, a single hand too, so scores is an array the
+        # flush fix up can write to
+        hands = cards.reshape(-1, cards.shape[-1])
+        # summing card by card beats a sum over a short last axis
+        key = _CARD_KEYS[hands[:, 0]]
+        for i in range(1, hands.shape[1]):
+            key += _CARD_KEYS[hands[:, i]]
+        bucket, slot = _hash(key & 0xFFFFFFFF)
+        slot = (slot + self._offsets[bucket]) & ((1 << _SLOT_BITS) - 1)
+        scores = self._scores[slot].astype(np.int64)
+
+        suit = _FLUSH_SUIT[key >> 32]
+        flushed = np.flatnonzero(suit >= 0)
+        if len(flushed):
+            in_suit = (hands[flushed] & 3) == suit[flushed, None]
+            mask = np.where(in_suit, 1 << (hands[flushed] >> 2), 0).sum(axis=-1)
+            scores[flushed] = np.minimum(scores[flushed], self._flush[mask])
+        return scores.reshape(cards.shape[:-1])
+
+    def evaluate_hands(self, board, hole_cards) -> np.ndarray:
+        """
+        Return treys score of each pair of hole cards on board
+        @param board: 3 to 5 card indexes
+        @param hole_cards: (n x 2) card indexes
+        """
+        hole_cards = np.asarray(hole_cards, dtype=np.int64).reshape(-1, 2)
+        board = np.broadcast_to(np.asarray(board, dtype=np.int64),
+                (len(hole_cards), len(board)))
+        return self.evaluate(np.concatenate([board, hole_cards], axis=1))
+
+
+_default = None
+
+def default_evaluator() -> LookupEvaluator:
+    """Return evaluator over the tables in TABLE_DIR, shared per process"""
+    global _default
+    if _default is None:
+        _default = LookupEvaluator()
+    return _default
+
+
+def random_hands(n_hands, k, rng, flush=False) -> np.ndarray:
+    """
+    Return (n_hands x k) random card indexes, distinct in each hand
+    @param flush: put 5 cards of one suit in every hand
+    """
+    if not flush:
+        return np.argsort(rng.rand(n_hands, 52), axis=1)[:, :k]
+    hands = np.empty((n_hands, k), dtype=np.int64)
+    for i in range(n_hands):
+        suit = rng.randint(4)
+        suited = 4 * rng.choice(N_RANKS, 5, replace=False) + suit
+        rest = np.setdiff1d(np.arange(52), suited)
+        hands[i] = np.concatenate([suited, rng.choice(rest, k - 5,
+            replace=False)])
+    return hands
+
+
+def check_against_treys(n_hands=30000, seed=0, evaluator=None) -> list:
+    """
+    Return hands scored differently from treys' Evaluator.evaluate, out of
+    n_hands random 5, 6 and 7 card hands each and as many flush hands
+    """
+    evaluator = evaluator or default_evaluator()
+    treys = Evaluator()
+    # card index -> treys card, same order as state.CARD_INDEX
+    cards = [Card.new(r + s) for r in '23456789TJQKA' for s in 'shdc']
+    rng = np.random.RandomState(seed)
+    wrong = []
+    for k in [5, 6, 7]:
+        for flush in [False, True]:
+            hands = random_hands(n_hands, k, rng, flush)
+            scores = evaluator.evaluate(hands)
+            for (hand, score) in zip(hands, scores):
+                hand = [cards[c] for c in hand]
+                if treys.evaluate(hand[:2], hand[2:]) != score:
+                    wrong.append(hand)
+    return wrong
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hands', type=int, default=30000,
+            help='random hands checked per hand size, and as many flushes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timed', type=int, default=1000000,
+            help='random 7 card hands timed')
+    args = parser.parse_args(argv)
+
+    evaluator = default_evaluator()
+    wrong = check_against_treys(args.hands, args.seed, evaluator)
+    print(f'{len(wrong)} of {6 * args.hands} hands differ from treys')
+    for hand in wrong[:10]:
+        print(' ', Card.ints_to_pretty_str(hand))
+
+    hands = random_hands(args.timed, 7, np.random.RandomState(args.seed))
+    t0 = time.perf_counter()
+    evaluator.evaluate(hands)
+    seconds = time.perf_counter() - t0
+    print(f'{args.timed / seconds:.3g} hands/sec')
+    return 1 if wrong else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
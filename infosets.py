@@ -0,0 +1,231 @@
+import numpy as np
+
+from state import HAND_BITS, encode_history
+
+def _normalize(weights) -> np.ndarray:
+    """Normalize last axis to sum to 1, uniform where it sums to 0"""
+    norm_sum = weights.sum(axis=-1, keepdims=True)
+    strategy = np.full(weights.shape, 1 / weights.shape[-1])
+    np.divide(weights, norm_sum, out=strategy, where=norm_sum > 0)
+    return strategy
+
+def regret_matching(regrets, plus=False) -> np.ndarray:
+    """
+    Return current strategy for an (..., n_actions) array of regrets,
+    one row per infoset or hand
+    @param plus: cfr+, floor the regrets at zero in place first
+    """
+    if plus:
+        return _normalize(np.maximum(regrets, 0, out=regrets))
+    return _normalize(np.maximum(regrets, 0))
+
+def average_strategy(strategy_sum) -> np.ndarray:
+    """Return average strategy for an (..., n_actions) array of sums"""
+    return _normalize(np.maximum(strategy_sum, 0))
+
+
+class ISet:
+    """Infoset node"""
+    def __init__(self, n_actions, regrets=None, strategy_sum=None):
+        # optionally a view into arrays owned by a trainer
+        self.regrets = np.zeros(n_actions) if regrets is None else regrets
+        self.strategy_sum = (np.zeros(n_actions)
+                if strategy_sum is None else strategy_sum)
+
+    def get_final_strategy(self):
+        """Get normalized strategy from strategy_sum"""
+        return average_strategy(self.strategy_sum)
+
+    def get_strategy(self):
+        """Get strategy for infoset through regret matching"""
+        return regret_matching(self.regrets)
+
+
+class InfosetTable:
+    """
+    Regrets and strategy sums of every infoset in a game tree, stored in
+    two contiguous float arrays.
+
+    Each decision node owns a block of n_hands x n_actions entries for
+    its acting player, so the infoset of hand h at node n starts at
+    offset[n] + h * n_actions and is indexed without hashing. The block of
+    a node can be viewed as a (n_hands x n_actions) matrix for range
+    vectorized trainers. With suit isomorphism combos mapped onto each
+    other share a row, and with a card abstraction combos in one bucket,
+    blocks are then (n_rows x n_actions) and rows(node) gives the row of
+    each hand.
+
+    Indexing the table with an infoset key from state.infoset_key gives an
+    ISet view. Iterating it yields "player hand history" strs, for display,
+    which can be used as keys too.
+    """
+    def __init__(self, tree, zeros=np.zeros):
+        """
+        @param tree: GameTree to allocate infosets for
+        @param zeros: allocator for the flat arrays, e.g. shared memory
+        """
+        self._tree = tree
+        self._n_hands = [len(tree.ranges[0]), len(tree.ranges[1])]
+
+        self._offsets = np.full(tree.n_nodes, -1, dtype=np.int64)
+        self._n_rows = np.zeros(tree.n_nodes, dtype=np.int64)
+        # node -> row of each hand, only for nodes where hands share rows
+        self._rows = dict()
+        size = 0
+        for node in range(tree.n_nodes):
+            player = tree.player[node]
+            if player < 0: continue
+            rows = tree.hand_rows(node, player)
+            if rows is None:
+                self._n_rows[node] = self._n_hands[player]
+            else:
+                self._rows[node] = rows
+                self._n_rows[node] = rows.max() + 1
+            self._offsets[node] = size
+            size += self._n_rows[node] * tree.n_children[node]
+        self._size = size
+
+        self.regrets = zeros(size)
+        self.strategy_sum = zeros(size)
+
+        # history key -> node, only used to look up by key
+        self._nodes = {int(h): n for (n, h) in enumerate(tree.history_key)}
+
+    @property
+    def size(self): return self._size
+
+    @property
+    def nbytes(self): return self.regrets.nbytes + self.strategy_sum.nbytes
+
+    def rows(self, node) -> np.ndarray:
+        """Return row of each hand at node, None if each has its own"""
+        return self._rows.get(node)
+
+    def n_rows(self, node) -> int:
+        return self._n_rows[node]
+
+    def offset(self, node) -> int:
+        """Return offset of the block of decision node"""
+        return self._offsets[node]
+
+    def index(self, node, hand) -> int:
+        """Return offset of infoset of hand at decision node"""
+        rows = self._rows.get(node)
+        if rows is not None:
+            hand = rows[hand]
+        return self._offsets[node] + hand * self._tree.n_children[node]
+
+    def get(self, node, hand) -> ISet:
+        """Return infoset of hand at decision node as a view"""
+        n_actions = self._tree.n_children[node]
+        start = self.index(node, hand)
+        return ISet(n_actions,
+                self.regrets[start:start + n_actions],
+                self.strategy_sum[start:start + n_actions])
+
+    def _block(self, array, node):
+        start = self._offsets[node]
+        n_rows = self._n_rows[node]
+        n_actions = self._tree.n_children[node]
+        return array[start:start + n_rows * n_actions].reshape(
+                n_rows, n_actions)
+
+    def node_regrets(self, node) -> np.ndarray:
+        """Return (n_rows x n_actions) view of regrets at node"""
+        return self._block(self.regrets, node)
+
+    def node_strategy_sum(self, node) -> np.ndarray:
+        """Return (n_rows x n_actions) view of strategy sums at node"""
+        return self._block(self.strategy_sum, node)
+
+    def hand_view(self, node, block) -> np.ndarray:
+        """Return (n_hands x n_actions) rows of block for each hand"""
+        rows = self._rows.get(node)
+        return block if rows is None else block[rows]
+
+    def accumulate(self, node, block, values):
+        """Add (n_hands x n_actions) values into the rows of block"""
+        rows = self._rows.get(node)
+        if rows is None:
+            block += values
+        else:
+            np.add.at(block, rows, values)
+
+    def decision_nodes(self):
+        return np.flatnonzero(self._offsets >= 0)
+
+    def n_reached(self) -> int:
+        """Return number of infosets with a nonzero strategy sum"""
+        return int(sum((self.node_strategy_sum(node) != 0).any(axis=1).sum()
+                for node in self.decision_nodes()))
+
+    def discount(self, regret_factor, strategy_factor=None,
+            negative_factor=None):
+        """
+        Scale all regrets and strategy sums in place
+        @param negative_factor: separate factor for negative regrets
+        """
+        if strategy_factor is None:
+            strategy_factor = regret_factor
+        if negative_factor is None:
+            self.regrets *= regret_factor
+        else:
+            self.regrets *= np.where(
+                    self.regrets > 0, regret_factor, negative_factor)
+        self.strategy_sum *= strategy_factor
+
+    def average_strategy(self) -> np.ndarray:
+        """
+        Return flat array of normalized strategy sums, uniform where an
+        infoset was never reached
+        """
+        strategy = np.empty(self._size)
+        for node in self.decision_nodes():
+            block = self.node_average_strategy(node)
+            start = self._offsets[node]
+            strategy[start:start + block.size] = block.ravel()
+        return strategy
+
+    def node_average_strategy(self, node) -> np.ndarray:
+        """Return (n_rows x n_actions) average strategy at node"""
+        return average_strategy(self.node_strategy_sum(node))
+
+    def export(self) -> dict:
+        """Return plain arrays describing the table"""
+        return {
+            'offsets': self._offsets.copy(),
+            'n_rows': self._n_rows.copy(),
+            'n_actions': self._tree.n_children.copy(),
+            'player': self._tree.player.copy(),
+            'history_key': self._tree.history_key.copy(),
+            'regrets': np.array(self.regrets),
+            'strategy_sum': np.array(self.strategy_sum),
+            'average_strategy': self.average_strategy(),
+        }
+
+    # display access with "player hand history" keys
+    def keys(self):
+        tree = self._tree
+        for node in self.decision_nodes():
+            player = tree.player[node]
+            # hands that can be dealt, the only infosets that are reachable
+            for hand in tree.live_hands(node, player):
+                yield str(player)+' '+str(hand)+' '+tree.history(node)
+
+    def __iter__(self): return self.keys()
+
+    def __len__(self):
+        tree = self._tree
+        n = 0
+        for node in self.decision_nodes():
+            live = tree.live_hands(node, tree.player[node])
+            rows = self._rows.get(node)
+            n += len(live) if rows is None else len(np.unique(rows[live]))
+        return n
+
+    def __getitem__(self, key) -> ISet:
+        if isinstance(key, str):
+            _, hand, history = key.split(' ')
+            return self.get(self._nodes[encode_history(history)], int(hand))
+        hand = (key >> 1) & ((1 << HAND_BITS) - 1)
+        return self.get(self._nodes[key >> (HAND_BITS + 1)], hand)
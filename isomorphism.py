@@ -0,0 +1,132 @@
+"""
+Suit isomorphism
+
+Relabeling suits maps a board, hands and ranges to a strategically
+identical game. Cards here are indexes 0..51 of state.CARD_INDEX, with the
+suit in the low two bits, and a suit permutation is an index into
+SUIT_PERMS.
+
+Used three ways:
+    canonical(board, hand)       one representative of every (board, hand)
+                                 class, e.g. as a cache key
+    card_orbits(cards, perms)    cards dealt at a chance node that lead to
+                                 identical runouts, merged into one outcome
+    combo_rows(combos, perms)    combos that play identically on a board,
+                                 sharing one strategy row
+"""
+import itertools
+
+import numpy as np
+
+from state import CARD_INDEX
+
+# perm id -> new suit of each suit, id 0 is the identity
+SUIT_PERMS = list(itertools.permutations(range(4)))
+IDENTITY = 0
+# perm id -> id of its inverse
+INVERSE = [SUIT_PERMS.index(tuple(np.argsort(p))) for p in SUIT_PERMS]
+
+
+def permute_card(card, perm) -> int:
+    """Return card 0..51 with its suit relabeled"""
+    return card - card % 4 + SUIT_PERMS[perm][card % 4]
+
+
+def compose(first, then) -> int:
+    """Return perm relabeling suits by first, then by then"""
+    return SUIT_PERMS.index(
+            tuple(SUIT_PERMS[then][s] for s in SUIT_PERMS[first]))
+
+
+def permute_cards(cards, perm) -> tuple:
+    """Return sorted cards with their suits relabeled"""
+    return tuple(sorted(permute_card(c, perm) for c in cards))
+
+
+def canonical(board, hand=()) -> (tuple, tuple, int):
+    """
+    Return (board, hand, perm) of the smallest relabeling of board, then
+    hand, as sorted card indexes, and the perm that maps to it
+    """
+    board = [int(c) for c in board]
+    hand = [int(c) for c in hand]
+    best = None
+    for perm in range(len(SUIT_PERMS)):
+        image = (permute_cards(board, perm), permute_cards(hand, perm))
+        if best is None or image < best[:2]:
+            best = image + (perm,)
+    return best
+
+
+def board_symmetries(board, perms=None) -> list:
+    """Return perms, of all or of perms, mapping board onto itself"""
+    board = tuple(sorted(int(c) for c in board))
+    if perms is None:
+        perms = range(len(SUIT_PERMS))
+    return [p for p in perms if permute_cards(board, p) == board]
+
+
+def _combo_index(combos) -> dict:
+    """Return dict of sorted (card, card) indexes -> combo index"""
+    return {tuple(sorted(CARD_INDEX[c] for c in combo)): i
+            for (i, combo) in enumerate(combos)}
+
+
+def combo_perm(combos, perm) -> np.ndarray:
+    """
+    Return index of the relabeled combo of each combo, None if a relabeled
+    combo is not in combos
+    """
+    index = _combo_index(combos)
+    image = np.empty(len(combos), dtype=np.int64)
+    for (cards, i) in index.items():
+        j = index.get(permute_cards(cards, perm))
+        if j is None: return None
+        image[i] = j
+    return image
+
+
+def range_symmetries(ranges, weights) -> list:
+    """Return perms mapping every weighted range onto itself"""
+    symmetries = []
+    for perm in range(len(SUIT_PERMS)):
+        images = [combo_perm(r, perm) for r in ranges]
+        if all(image is not None and np.array_equal(w[image], w)
+                for (image, w) in zip(images, weights)):
+            symmetries.append(perm)
+    return symmetries
+
+
+def card_orbits(cards, perms) -> list:
+    """
+    Group cards into classes mapped onto each other by perms, a group of
+    suit permutations
+    @return: list of (representative card, [perm mapping it to each card
+        of its class])
+    """
+    orbits = []
+    seen = set()
+    for card in sorted(cards):
+        if card in seen: continue
+        members = dict()
+        for p in perms:
+            members.setdefault(permute_card(card, p), p)
+        seen.update(members)
+        orbits.append((card, list(members.values())))
+    return orbits
+
+
+def combo_rows(combos, perms) -> (np.ndarray, int):
+    """
+    Return row of each combo, combos mapped onto each other by perms share
+    a row, and the number of rows
+    """
+    images = [combo_perm(combos, p) for p in perms]
+    rows = np.full(len(combos), -1, dtype=np.int64)
+    n_rows = 0
+    for i in range(len(combos)):
+        if rows[i] >= 0: continue
+        for image in images:
+            rows[image[i]] = n_rows
+        n_rows += 1
+    return rows, n_rows
@@ -0,0 +1,102 @@
+import mmap
+import multiprocessing as mp
+import os
+import random
+
+import numpy as np
+
+from cfr import MCCFRTrainer
+
+# trainer shared with pool workers, set in the parent right before forking
+_worker_trainer = None
+
+def _init_worker():
+    # forked workers inherit the parent's rng state, reseed from os entropy
+    random.seed()
+    np.random.seed()
+
+# counters summed back from the workers after every batch
+_COUNTERS = ['_nodes_touched', '_terminal_evals', '_chance_nodes',
+        '_nodes_pruned']
+
+def _run_iterations(ts):
+    """Run mccfr iterations ts in a worker and return counter increments"""
+    trainer = _worker_trainer
+    before = [getattr(trainer, name, 0) for name in _COUNTERS]
+    for t in ts:
+        trainer.iteration(t)
+    return [getattr(trainer, name, 0) - b
+            for (name, b) in zip(_COUNTERS, before)]
+
+
+def _shared_zeros(n):
+    """Return float64 array of size n in anonymous shared memory"""
+    buf = mmap.mmap(-1, max(n, 1) * 8)
+    return np.frombuffer(buf, dtype=np.float64, count=n)
+
+
+class ParallelMCCFRTrainer(MCCFRTrainer):
+    """
+    external sampling mccfr running on a pool of worker processes
+
+    The trainer's InfosetTable, and the regret pruning holds back, are
+    allocated in shared memory, so they are seen by every worker. Workers
+    are forked and update the arrays Hogwild style without locks, so the
+    sampled traversals of different workers never wait on each other. A
+    telemetry is called after every batch of iterations, batches end on
+    its samples.
+    """
+    _zeros = staticmethod(_shared_zeros)
+
+    def __init__(self, initial_state, n_workers=None, discount=False,
+            pruning=False):
+        super().__init__(initial_state, discount=discount, pruning=pruning)
+        self._n_workers = n_workers or os.cpu_count()
+
+    @property
+    def n_workers(self): return self._n_workers
+
+    def config(self) -> dict:
+        config = super().config()
+        config['n_workers'] = self._n_workers
+        return config
+
+    def train(self, T):
+        """
+        Split the next T - 1 iterations across workers
+        when discounting, workers are synced every discount interval
+        @param T: iteration count
+        """
+        global _worker_trainer
+        first = self._iterations + 1
+        last = first + T - 1
+        interval = self._d_interval
+
+        _worker_trainer = self
+        ctx = mp.get_context('fork')
+        with ctx.Pool(self._n_workers, initializer=_init_worker) as pool:
+            start = first
+            while start < last:
+                end = last
+                if self.discount:
+                    # end batch on the next discount interval
+                    end = min(((start - 1) // interval + 1) * interval + 1, last)
+                if self._telemetry is not None:
+                    # and on the next telemetry sample
+                    end = min(end, start + self._telemetry.every)
+                # interleave iterations so every worker sees early and late t
+                jobs = [range(start + w, end, self._n_workers)
+                        for w in range(self._n_workers)]
+                for counts in pool.map(_run_iterations, jobs):
+                    for (name, n) in zip(_COUNTERS, counts):
+                        if hasattr(self, name):
+                            setattr(self, name, getattr(self, name) + n)
+
+                self._iterations = end - 1
+                if self.discount and (end - 1) % interval == 0:
+                    self.apply_discount(end - 1)
+                start = end
+                if self._telemetry is not None \
+                        and self._telemetry.on_iteration(self):
+                    break
+        _worker_trainer = None
@@ -0,0 +1,480 @@
+"""
+Local solve server
+
+Jobs (board, ranges, bet sizing, trainer and stopping rule) are put on a
+queue and solved by a pool of worker processes. Each worker trains in
+chunks until the job reaches its target exploitability, time budget or
+iteration cap, reporting iterations and exploitability after every chunk.
+Progress, results and the solved strategy of every job are written to a
+results directory:
+
+    <store>/<job id>/job.json         job as submitted
+    <store>/<job id>/progress.jsonl   one line per chunk
+    <store>/<job id>/result.json      final status
+    <store>/<job id>/strategy/        checkpoint of the trainer
+
+Solve a file of json jobs, one per line, on every core:
+
+    python server.py jobs.jsonl --store results
+
+or serve jobs over http on localhost:
+
+    python server.py --serve 8000 --store results
+    curl -d '{"board": ["Td", "9d", "6h", "2h", "2c"]}' localhost:8000/jobs
+    curl localhost:8000/jobs/<job id>
+"""
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import re
+import signal
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from poker.hand import Range
+from treys import Card
+
+from state import State, GameConfig, build_range, range_weights
+from benchmark import TRAINERS
+from betting import BetSizing
+from abstraction import CardAbstraction
+from checkpoint import save_checkpoint
+from exploitability import exploitability_report
+
+DEFAULT_RANGE = '88+ AJo+ ATs+ KQ KJ JTs T9s'
+# job ids name a directory of the store, so no separators or dots
+JOB_ID = re.compile(r'[0-9A-Za-z_-]{1,64}')
+
+# range str -> combos, so a process parses each range once and reuses
+# the card masks cached for it
+_parsed_ranges = dict()
+
+def parse_card(card) -> int:
+    """
+    Return treys card of card str, e.g. 'Td'
+    @raise ValueError: if card is not a card
+    """
+    try:
+        if len(card) == 2:
+            return Card.new(card)
+    except (KeyError, IndexError, TypeError):
+        pass
+    raise ValueError(f'invalid card {card!r}')
+
+
+def check_number(name, value, positive=False, integer=False):
+    """
+    Raise ValueError unless value is a finite number, >= 0 or > 0
+    @param integer: only accept ints
+    """
+    kinds = int if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kinds) \
+            or not math.isfinite(value):
+        kind = 'an integer' if integer else 'a number'
+        raise ValueError(f'{name} must be {kind}, got {value!r}')
+    if positive and value <= 0:
+        raise ValueError(f'{name} must be positive')
+    if value < 0:
+        raise ValueError(f'{name} must not be negative')
+
+
+def valid_job_id(job_id) -> bool:
+    """Return true if job_id is safe to use as a directory name"""
+    return isinstance(job_id, str) and JOB_ID.fullmatch(job_id) is not None
+
+
+def parse_range(range_str) -> list:
+    """
+    Return combos of range str, cached per process
+    @raise ValueError: if range_str is not a range
+    """
+    combos = _parsed_ranges.get(range_str)
+    if combos is None:
+        combos = _parsed_ranges[range_str] = build_range(
+                Range(range_str).combos)
+    return combos
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class SolveJob:
+    """One spot to solve and when to stop"""
+    def __init__(self, board, p1_range=DEFAULT_RANGE, p2_range=DEFAULT_RANGE,
+            weights=None, stack=1000, pot=100, bet_sizes=None, betting=None,
+            trainer='dcfr', options=None, target_mbb=None, budget=60,
+            max_iterations=None, isomorphism=False, abstraction=None,
+            job_id=None):
+        """
+        @param board: list of card strs, e.g. ['Td', '9d', '6h', '2h', '2c']
+        @param p1_range, p2_range: range strs, e.g. 'QQ+ AK'
+        @param weights: (p1, p2) dicts of combo or hand class -> weight
+        @param stack: chips behind of each player
+        @param pot: starting pot
+        @param bet_sizes: sizes of betting.BetSizing, None for a single pot
+            sized bet and 2x raise
+        @param betting: other keyword arguments of betting.BetSizing
+        @param trainer: name of trainer in benchmark.TRAINERS
+        @param options: keyword arguments of the trainer
+        @param target_mbb: stop once exploitability in mbb/pot is below
+        @param budget: stop after this many training seconds
+        @param max_iterations: stop after this many iterations
+        @param isomorphism: merge cards and combos only differing by suits
+        @param abstraction: keyword arguments of abstraction.CardAbstraction,
+            None to keep one infoset per combo
+        """
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.board = list(board)
+        self.p1_range = p1_range
+        self.p2_range = p2_range
+        self.weights = weights
+        self.stack = stack
+        self.pot = pot
+        self.bet_sizes = bet_sizes
+        self.betting = betting
+        self.trainer = trainer
+        self.options = options or dict()
+        self.target_mbb = target_mbb
+        self.budget = budget
+        self.max_iterations = max_iterations
+        self.isomorphism = isomorphism
+        self.abstraction = abstraction
+        self.validate()
+
+    def validate(self):
+        """Raise ValueError if the job can't be solved"""
+        if not valid_job_id(self.job_id):
+            raise ValueError(f'invalid job id {self.job_id!r}')
+        if len(self.board) not in (3, 4, 5):
+            raise ValueError('board needs 3 to 5 cards')
+        for c in self.board:
+            parse_card(c)
+        if len(set(self.board)) != len(self.board):
+            raise ValueError('board has duplicate cards')
+        for r in [self.p1_range, self.p2_range]:
+            if not isinstance(r, str) or not parse_range(r):
+                raise ValueError(f'invalid range {r!r}')
+        check_number('stack', self.stack, positive=True)
+        check_number('pot', self.pot, positive=True)
+        for (name, value) in [('target_mbb', self.target_mbb),
+                ('budget', self.budget)]:
+            if value is not None:
+                check_number(name, value)
+        if self.max_iterations is not None:
+            check_number('max_iterations', self.max_iterations, integer=True)
+        if self.trainer not in TRAINERS:
+            raise ValueError(f'unknown trainer {self.trainer}')
+        if self.betting is not None and self.bet_sizes is None:
+            raise ValueError('betting options need bet_sizes')
+        self.bet_sizing()
+        self.card_abstraction()
+        if self.target_mbb is None and self.budget is None \
+                and self.max_iterations is None:
+            raise ValueError('job has no stopping rule')
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def bet_sizing(self) -> BetSizing:
+        if self.bet_sizes is None: return None
+        return BetSizing(self.bet_sizes, **(self.betting or dict()))
+
+    def card_abstraction(self) -> CardAbstraction:
+        if self.abstraction is None: return None
+        return CardAbstraction(**self.abstraction)
+
+    def game_config(self) -> GameConfig:
+        ranges = (parse_range(self.p1_range), parse_range(self.p2_range))
+        weights = None
+        if self.weights is not None:
+            weights = tuple(range_weights(r, w)
+                    for (r, w) in zip(ranges, self.weights))
+        return GameConfig([parse_card(c) for c in self.board], *ranges,
+                weights=weights, stack=self.stack, pot=self.pot,
+                betting=self.bet_sizing(), isomorphism=self.isomorphism,
+                abstraction=self.card_abstraction())
+
+    def initial_state(self) -> State:
+        """Return initial state of job"""
+        return self.game_config().initial_state()
+
+
+def solve(job, report, checkpoint_path=None):
+    """
+    Train job until it meets its stopping rule
+    @param report: called with a progress dict after every chunk
+    @param checkpoint_path: directory to save the trained trainer to
+    @return: result dict
+    """
+    factory, chunk = TRAINERS[job.trainer]
+    trainer = factory(job.initial_state(), **job.options)
+
+    seconds = 0.0
+    while True:
+        if job.max_iterations is not None:
+            chunk = min(chunk, job.max_iterations - trainer.iterations)
+        t0 = time.perf_counter()
+        # train(T) runs T - 1 iterations
+        trainer.train(chunk + 1)
+        seconds += time.perf_counter() - t0
+
+        progress = {'iterations': trainer.iterations, 'seconds': seconds}
+        progress.update(exploitability_report(trainer))
+        report(progress)
+
+        if job.target_mbb is not None \
+                and progress['mbb_per_pot'] <= job.target_mbb:
+            break
+        if job.budget is not None and seconds >= job.budget:
+            break
+        if job.max_iterations is not None \
+                and trainer.iterations >= job.max_iterations:
+            break
+
+    if checkpoint_path is not None:
+        save_checkpoint(trainer, checkpoint_path)
+    return progress
+
+
+def _worker(jobs, messages, store_dir):
+    """Solve jobs from queue until a None job, posting messages"""
+    # ctrl-c goes to the parent, which drains the queue on shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        job = jobs.get()
+        if job is None: return
+        job = SolveJob.from_dict(job)
+        messages.put((job.job_id, RUNNING, None))
+        try:
+            def report(progress):
+                messages.put((job.job_id, 'progress', progress))
+            path = os.path.join(store_dir, job.job_id, 'strategy')
+            result = solve(job, report, checkpoint_path=path)
+            messages.put((job.job_id, DONE, result))
+        except Exception:
+            messages.put((job.job_id, FAILED,
+                {'error': traceback.format_exc()}))
+
+
+class ResultsStore:
+    """Directory of job specs, progress logs and results"""
+    def __init__(self, path):
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        # job id -> status dict, for jobs of this session
+        self._status = dict()
+
+    @property
+    def path(self): return self._path
+
+    def _file(self, job_id, name):
+        return os.path.join(self._path, job_id, name)
+
+    def add(self, job):
+        os.makedirs(os.path.join(self._path, job.job_id), exist_ok=True)
+        with open(self._file(job.job_id, 'job.json'), 'w') as f:
+            json.dump(job.to_dict(), f)
+        with self._lock:
+            self._status[job.job_id] = {'job_id': job.job_id,
+                    'status': QUEUED, 'progress': None}
+
+    def update(self, job_id, kind, data):
+        """Record a worker message"""
+        with self._lock:
+            status = self._status.setdefault(job_id,
+                    {'job_id': job_id, 'progress': None})
+            if kind == 'progress':
+                status['progress'] = data
+                with open(self._file(job_id, 'progress.jsonl'), 'a') as f:
+                    f.write(json.dumps(data) + '\n')
+                return
+            status['status'] = kind
+            if kind in (DONE, FAILED):
+                status['result'] = data
+                with open(self._file(job_id, 'result.json'), 'w') as f:
+                    json.dump(status, f)
+
+    def status(self, job_id) -> dict:
+        """Return status of job, reading finished jobs from disk"""
+        if not valid_job_id(job_id):
+            raise KeyError(job_id)
+        with self._lock:
+            if job_id in self._status:
+                return dict(self._status[job_id])
+        path = self._file(job_id, 'result.json')
+        if not os.path.exists(path):
+            raise KeyError(job_id)
+        with open(path) as f:
+            return json.load(f)
+
+    def all_status(self) -> list:
+        with self._lock:
+            return [dict(s) for s in self._status.values()]
+
+    def progress(self, job_id) -> list:
+        """Return every progress sample of job"""
+        if not valid_job_id(job_id): return []
+        path = self._file(job_id, 'progress.jsonl')
+        if not os.path.exists(path): return []
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+
+class SolveServer:
+    """Queue of jobs solved by a pool of worker processes"""
+    def __init__(self, store, n_workers=None):
+        """
+        @param store: ResultsStore or directory
+        @param n_workers: worker processes, defaults to one per core
+        """
+        if not isinstance(store, ResultsStore):
+            store = ResultsStore(store)
+        self._store = store
+        self._n_workers = n_workers or os.cpu_count()
+        ctx = mp.get_context('fork')
+        self._jobs = ctx.Queue()
+        self._messages = ctx.Queue()
+        self._workers = [ctx.Process(target=_worker,
+                args=(self._jobs, self._messages, store.path))
+                for _ in range(self._n_workers)]
+        self._pending = 0
+        self._done = threading.Condition()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+
+    @property
+    def store(self): return self._store
+
+    def start(self):
+        for w in self._workers:
+            w.start()
+        self._collector.start()
+        return self
+
+    def submit(self, job) -> str:
+        """Queue job, a SolveJob or dict, and return its id"""
+        if not isinstance(job, SolveJob):
+            job = SolveJob.from_dict(job)
+        self._store.add(job)
+        with self._done:
+            self._pending += 1
+        self._jobs.put(job.to_dict())
+        return job.job_id
+
+    def _collect(self):
+        while True:
+            msg = self._messages.get()
+            if msg is None: return
+            job_id, kind, data = msg
+            self._store.update(job_id, kind, data)
+            if kind in (DONE, FAILED):
+                with self._done:
+                    self._pending -= 1
+                    self._done.notify_all()
+
+    def wait(self):
+        """Block until every submitted job has finished"""
+        with self._done:
+            self._done.wait_for(lambda: self._pending == 0)
+
+    def shutdown(self):
+        """Finish queued jobs and stop the workers"""
+        for _ in self._workers:
+            self._jobs.put(None)
+        for w in self._workers:
+            w.join()
+        self._messages.put(None)
+        self._collector.join()
+
+    def __enter__(self): return self.start()
+
+    def __exit__(self, *args): self.shutdown()
+
+
+def _handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != '/jobs':
+                return self._send(404, {'error': 'not found'})
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                job_id = server.submit(json.loads(self.rfile.read(length)))
+            except (ValueError, TypeError) as e:
+                return self._send(400, {'error': str(e)})
+            self._send(202, {'job_id': job_id})
+
+        def do_GET(self):
+            parts = self.path.strip('/').split('/')
+            if parts == ['jobs']:
+                return self._send(200, server.store.all_status())
+            if len(parts) == 2 and parts[0] == 'jobs':
+                try:
+                    status = server.store.status(parts[1])
+                except KeyError:
+                    return self._send(404, {'error': 'unknown job'})
+                status['curve'] = server.store.progress(parts[1])
+                return self._send(200, status)
+            self._send(404, {'error': 'not found'})
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+def serve(server, port):
+    """Serve jobs of server over http on localhost until interrupted"""
+    httpd = ThreadingHTTPServer(('127.0.0.1', port), _handler(server))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    httpd.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('jobs', nargs='?', help='file of json jobs')
+    parser.add_argument('--store', default='results')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--serve', type=int, default=None, metavar='PORT')
+    args = parser.parse_args(argv)
+
+    with SolveServer(args.store, args.workers) as server:
+        if args.jobs:
+            with open(args.jobs) as f:
+                for line in f:
+                    if line.strip():
+                        server.submit(json.loads(line))
+        if args.serve is not None:
+            serve(server, args.serve)
+        server.wait()
+        for status in server.store.all_status():
+            result = status.get('result') or {}
+            print(f"{status['job_id']} {status['status']:>7} "
+                    f"{result.get('iterations', 0):>8} it "
+                    f"{result.get('mbb_per_pot', float('nan')):10.2f} mbb/pot")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import numpy as np
+
+from state import range_cards
+from tree import SHOWDOWN, P1_FOLDED
+
+# larger than any treys score, used to group (card, score) keys
+_MAX_SCORE = 8192
+
+class Showdown:
+    """
+    Showdown values of every combo in a range against an opponent range
+    on a fixed board.
+
+    Opponent combos are sorted by score once, then each call computes the
+    weight every hand beats / loses to with prefix sums and binary search.
+    Opponent combos sharing a card with the hand are removed by the same
+    trick applied per card, so the cost is O(n log n) instead of n^2.
+    """
+    def __init__(self, combos, ranks, opp_combos, opp_ranks):
+        """
+        @param combos: list of (card, card) for the evaluated range
+        @param ranks: treys score of each combo, lower is better
+        @param opp_combos: list of (card, card) for the opponent range
+        @param opp_ranks: treys score of each opponent combo
+        """
+        ranks = np.asarray(ranks, dtype=np.int64)
+        opp_ranks = np.asarray(opp_ranks, dtype=np.int64)
+        cards = range_cards(combos)
+        opp_cards = range_cards(opp_combos)
+
+        # opponent combos in order of score
+        self._order = np.argsort(opp_ranks, kind='stable')
+        sorted_ranks = opp_ranks[self._order]
+        # number of opponent combos strictly better / not worse than hand
+        self._n_better = np.searchsorted(sorted_ranks, ranks, side='left')
+        self._n_not_worse = np.searchsorted(sorted_ranks, ranks, side='right')
+
+        # same again, restricted to opponent combos holding a given card
+        # each opponent combo appears once per card, keyed by (card, score)
+        card_keys = opp_cards.T.ravel() * _MAX_SCORE + np.tile(opp_ranks, 2)
+        self._card_order = np.argsort(card_keys, kind='stable')
+        self._card_combo = np.tile(np.arange(len(opp_combos)), 2)[self._card_order]
+        sorted_keys = card_keys[self._card_order]
+        # start of each card's group
+        hand_starts = np.searchsorted(sorted_keys, cards * _MAX_SCORE)
+        hand_keys = cards * _MAX_SCORE + ranks[:, None]
+        self._card_start = hand_starts
+        self._card_better = np.searchsorted(sorted_keys, hand_keys, side='left')
+        self._card_not_worse = np.searchsorted(sorted_keys, hand_keys, side='right')
+        self._card_end = np.searchsorted(sorted_keys, (cards + 1) * _MAX_SCORE)
+
+        # opponent combo holding the exact same cards, -1 if none
+        index = {frozenset(c): j for (j, c) in enumerate(opp_combos)}
+        self._same = np.array(
+                [index.get(frozenset(c), -1) for c in combos], dtype=np.int64)
+
+    def _prefix(self, opp_reach):
+        """Return (prefix sums over score order, prefix sums per card)"""
+        prefix = np.zeros(len(opp_reach) + 1)
+        np.cumsum(opp_reach[self._order], out=prefix[1:])
+        card_prefix = np.zeros(len(self._card_combo) + 1)
+        np.cumsum(opp_reach[self._card_combo], out=card_prefix[1:])
+        return prefix, card_prefix
+
+    def _same_reach(self, opp_reach):
+        return np.where(self._same >= 0, opp_reach[self._same], 0)
+
+    def values(self, opp_reach) -> np.ndarray:
+        """
+        Return opponent weight each hand beats minus weight it loses to,
+        counting only opponent combos that do not share a card with it
+        """
+        prefix, card_prefix = self._prefix(opp_reach)
+        lose = prefix[self._n_better]
+        win = prefix[-1] - prefix[self._n_not_worse]
+
+        # remove blocked opponent combos, identical combos always tie
+        # so they are never double counted
+        lose = lose - (card_prefix[self._card_better]
+                - card_prefix[self._card_start]).sum(axis=1)
+        win = win - (card_prefix[self._card_end]
+                - card_prefix[self._card_not_worse]).sum(axis=1)
+        return win - lose
+
+    def reach(self, opp_reach) -> np.ndarray:
+        """
+        Return total opponent weight not sharing a card with each hand,
+        used for fold payoffs
+        """
+        prefix, card_prefix = self._prefix(opp_reach)
+        blocked = (card_prefix[self._card_end]
+                - card_prefix[self._card_start]).sum(axis=1)
+        # a combo sharing both cards was removed twice
+        return prefix[-1] - blocked + self._same_reach(opp_reach)
+
+
+class TerminalEvaluator:
+    """
+    Counterfactual values of a whole range at the terminal nodes of a
+    game tree, given the opponent's reach probabilities
+    """
+    def __init__(self, tree):
+        self._tree = tree
+        chance = tree.chance
+        # combo weights, zero for hands that can't be dealt
+        self.initial_reach = [chance.weights[0], chance.weights[1]]
+        # a pair is dealt with probability w1 * w2 * norm, the opponent's
+        # weight is in its reach and blocked pairs are removed by the
+        # showdown engines
+        self._weight = [r * chance.norm for r in self.initial_reach]
+
+        # sorted-strength showdown engines of each runout, one per
+        # player's point of view, built when the runout is first shown down
+        self._showdowns = dict()
+        self._showdown(0)
+
+    def _showdown(self, runout) -> list:
+        showdown = self._showdowns.get(runout)
+        if showdown is None:
+            tree = self._tree
+            ranks = tree.board_ranks(runout)
+            showdown = self._showdowns[runout] = [
+                    Showdown(tree.ranges[0], ranks[0],
+                        tree.ranges[1], ranks[1]),
+                    Showdown(tree.ranges[1], ranks[1],
+                        tree.ranges[0], ranks[0])]
+        return showdown
+
+    def values(self, node, player, opp_reach) -> np.ndarray:
+        """Return counterfactual value of each hand of player at terminal"""
+        tree = self._tree
+        value = tree.pot[node] / 2.0
+        payoff = tree.payoff[node]
+        weight = self._weight[player]
+
+        if payoff == SHOWDOWN:
+            showdown = self._showdown(tree.runout[node])[player]
+            return value * weight * showdown.values(opp_reach)
+
+        # player who folded loses half the pot, card removal between the
+        # hands is the same on every board
+        if payoff == P1_FOLDED + player:
+            value = -value
+        return value * weight * self._showdowns[0][player].reach(opp_reach)
@@ -1,6 +1,7 @@
-from treys import Card, Deck, Evaluator
+import collections
+import numpy as np
+from treys import Card, Evaluator
 from poker.hand import Range
-from copy import deepcopy
 
 evaluator = Evaluator()
 
@@ -12,6 +13,15 @@ TERMINAL_ID = 3
 DECK_SIZE = 52
 
 # cards are 0->51
+# map treys card int -> 0..51
+RANK_CHARS = '23456789TJQKA'
+SUIT_CHARS = 'shdc'
+CARD_INDEX = {Card.new(r + s): 4 * i + j
+        for (i, r) in enumerate(RANK_CHARS)
+        for (j, s) in enumerate(SUIT_CHARS)}
+# map 0..51 -> treys card int
+INDEX_CARD = sorted(CARD_INDEX, key=CARD_INDEX.get)
+
 CHECK = 0
 FOLD = 1
 CALL = 2
@@ -20,11 +30,121 @@ RAISE = 4
 
 PLAYER_ACTIONS = [CHECK, FOLD, CALL, BET, RAISE]
 
+# ids of sized bets and raises of a betting.BetSizing, SIZED_BET + index of
+# the size, up to MAX_SIZES sizes, and of going all in
+SIZED_BET = 5
+MAX_SIZES = 8
+ALL_IN = SIZED_BET + MAX_SIZES
+
 PREFLOP = 0
 FLOP = 1
 TURN = 2
 RIVER = 3
 
+# street of a board of n cards
+BOARD_STREET = {0: RIVER, 3: FLOP, 4: TURN, 5: RIVER}
+
+# histories are encoded as base HISTORY_BASE ints, one digit per symbol
+# digit 0 is unused so leading symbols are never lost
+# a deal, then one symbol per action id, sized bets show as their index
+# a public card is a deal followed by rank and suit digits, shown as '/7h'
+HISTORY_CHARS = 'dxfcbr' + '01234567' + 'a'
+HISTORY_BASE = 16
+# combo index bits in an infoset key
+HAND_BITS = 11
+
+_DEAL = HISTORY_CHARS.index('d') + 1
+
+def encode_history(history, key=0) -> int:
+    """Return int key of history str, appended to key"""
+    i = 0
+    while i < len(history):
+        if history[i] == '/':
+            key = history_card(key, CARD_INDEX[Card.new(history[i + 1:i + 3])])
+            i += 3
+            continue
+        key = key * HISTORY_BASE + HISTORY_CHARS.index(history[i]) + 1
+        i += 1
+    return key
+
+def history_card(key, card) -> int:
+    """Return history key with public card 0..51 appended"""
+    rank, suit = divmod(card, 4)
+    return ((key * HISTORY_BASE + _DEAL) * HISTORY_BASE + rank + 1) \
+            * HISTORY_BASE + suit + 1
+
+def history_digit(action) -> int:
+    """Return history digit of player action id"""
+    return action + 2
+
+def decode_history(key) -> str:
+    """Return history str of int key, for display"""
+    digits = []
+    while key > 0:
+        key, digit = divmod(key, HISTORY_BASE)
+        digits.append(digit)
+    digits.reverse()
+    history = ''
+    i = 0
+    while i < len(digits):
+        # deals after the first action are public cards
+        if digits[i] == _DEAL and history.strip('d'):
+            history += '/' + RANK_CHARS[digits[i + 1] - 1] \
+                    + SUIT_CHARS[digits[i + 2] - 1]
+            i += 3
+            continue
+        history += HISTORY_CHARS[digits[i] - 1]
+        i += 1
+    return history
+
+def infoset_key(player, hand, history_key) -> int:
+    """Pack player, combo index and history key into one int"""
+    return (((history_key << HAND_BITS) | hand) << 1) | player
+
+def decode_infoset_key(key) -> str:
+    """Return "player hand history" str of infoset key, for display"""
+    player = key & 1
+    hand = (key >> 1) & ((1 << HAND_BITS) - 1)
+    history_key = key >> (HAND_BITS + 1)
+    return str(player)+' '+str(hand)+' '+decode_history(history_key)
+
+def card_mask(cards) -> int:
+    """Return 52 bit mask of treys cards"""
+    mask = 0
+    for c in cards:
+        mask |= 1 << CARD_INDEX[c]
+    return mask
+
+# id of range -> (range, dict of tables computed from it), tables only
+# depend on the range so they are shared by every board it is solved on,
+# least recently used ranges dropped first
+CACHED_RANGES = 32
+_range_tables = collections.OrderedDict()
+
+def _range_table(combos, name, build):
+    cached = _range_tables.get(id(combos))
+    if cached is None or cached[0] is not combos:
+        cached = _range_tables[id(combos)] = (combos, dict())
+        if len(_range_tables) > CACHED_RANGES:
+            _range_tables.popitem(last=False)
+    else:
+        _range_tables.move_to_end(id(combos))
+    tables = cached[1]
+    if name not in tables:
+        tables[name] = build(combos)
+    return tables[name]
+
+def range_masks(combos) -> np.ndarray:
+    """Return uint64 card mask of each combo, cached per range"""
+    return _range_table(combos, 'masks', lambda combos: np.array(
+        [card_mask(c) for c in combos], dtype=np.uint64))
+
+def range_cards(combos) -> np.ndarray:
+    """Return (n_combos x 2) card indexes 0..51 of each combo, cached per range"""
+    return _range_table(combos, 'cards', lambda combos: np.array(
+        [[CARD_INDEX[c] for c in combo] for combo in combos],
+        dtype=np.int64).reshape(-1, 2))
+
 def build_range(combos):
     # convert pretty suit to char
     def suit_to_char(s):
@@ -45,6 +165,96 @@ def build_range(combos):
 
     return r
 
+def range_weights(combos, weights=None) -> np.ndarray:
+    """
+    Return weight of each combo
+    @param weights: dict of combo ('AhKh') or hand class ('AKs', 'AKo',
+        'AA') -> weight, combos not in it weigh 1
+    """
+    w = np.ones(len(combos))
+    if not weights: return w
+    for (i, combo) in enumerate(combos):
+        (r1, s1), (r2, s2) = [Card.int_to_str(c) for c in combo]
+        hi, lo = sorted([r1, r2], key='AKQJT98765432'.index)
+        hand_class = hi + lo + ('' if r1 == r2 else 's' if s1 == s2 else 'o')
+        for key in [r1 + s1 + r2 + s2, r2 + s2 + r1 + s1, hand_class]:
+            if key in weights:
+                w[i] = weights[key]
+                break
+    return w
+
+
+class GameConfig:
+    """
+    Everything fixed for one solve: board, ranges, combo weights, stacks,
+    starting pot and street. Created once and shared by reference by every
+    state of the solve, so several solves can live in one process.
+    """
+    def __init__(self, board, p1_range, p2_range, weights=None, stack=1000,
+            pot=100, street=None, betting=None, isomorphism=False,
+            abstraction=None):
+        """
+        @param board: list of treys cards, 3 to 5 of them
+        @param p1_range, p2_range: lists of (card, card) combos
+        @param weights: (p1, p2) arrays of combo weights, all 1 if None
+        @param stack: chips behind of each player
+        @param pot: chips in the pot
+        @param street: FLOP, TURN or RIVER, by default the street of the
+            board, later streets are dealt by chance nodes
+        @param betting: betting.BetSizing the game tree is built with, None
+            for the pot bet and 2x raise of State.apply_action
+        @param isomorphism: merge dealt cards and combos that only differ
+            by suits, see isomorphism.py
+        @param abstraction: abstraction.CardAbstraction bucketing combos
+            on every board, None to keep one infoset per combo
+        """
+        self.board = sorted(board)
+        self.ranges = (p1_range, p2_range)
+        if weights is None:
+            weights = (None, None)
+        self.weights = tuple(np.ones(len(r)) if w is None
+                else np.asarray(w, dtype=np.float64)
+                for (r, w) in zip(self.ranges, weights))
+        self.stack = stack
+        self.pot = pot
+        if street is None:
+            street = BOARD_STREET[len(self.board)]
+        self.street = street
+        self.betting = betting
+        self.isomorphism = isomorphism
+        self.abstraction = abstraction
+        # cards no combo can be dealt with
+        self.dead = card_mask(self.board)
+
+    @classmethod
+    def from_strings(cls, board, p1_range, p2_range, weights=None, **kwargs):
+        """
+        Build config from card and range strs
+        @param board: list of card strs, e.g. ['Td', '9d', '6h', '2h', '2c']
+        @param p1_range, p2_range: range strs, e.g. 'QQ+ AK'
+        @param weights: (p1, p2) dicts of combo or hand class -> weight
+        """
+        ranges = (build_range(Range(p1_range).combos),
+                build_range(Range(p2_range).combos))
+        if weights is not None:
+            weights = tuple(range_weights(r, w)
+                    for (r, w) in zip(ranges, weights))
+        return cls([Card.new(c) for c in board], *ranges, weights=weights,
+                **kwargs)
+
+    def with_board(self, board):
+        """Return copy of config on another board"""
+        return GameConfig(board, *self.ranges, weights=self.weights,
+                stack=self.stack, pot=self.pot, street=self.street,
+                betting=self.betting, isomorphism=self.isomorphism,
+                abstraction=self.abstraction)
+
+    def initial_state(self):
+        """Return state before hands are dealt"""
+        return State(self)
+
+
+# default ranges of State()
 p1_range = build_range(Range('88+ AJo+ ATs+ KQ KJ JTs T9s').combos)
 p2_range = build_range(Range('88+ AJo+ ATs+ KQ KJ JTs T9s').combos)
 # p2_range = build_range(Range('QQ+ KQ+ AQ+').combos)
@@ -54,9 +264,9 @@ p2_range = build_range(Range('88+ AJo+ ATs+ KQ KJ JTs T9s').combos)
 #         Range('22+ A2+ K2+ Q2+ J2+ T2+ 92+ 82+ 72+ 62+ 52+ 42+ 32+').combos)
 
 class PlayerState:
-    def __init__(self):
+    def __init__(self, stack=1000):
         # current number of chips
-        self._stack = 1000
+        self._stack = stack
 
         # current cards
         self._hand = None
@@ -64,6 +274,14 @@ class PlayerState:
         self._wager = 0
         self._has_folded = False
 
+    def copy(self):
+        new_player = PlayerState()
+        new_player._stack = self._stack
+        new_player._hand = self._hand
+        new_player._wager = self._wager
+        new_player._has_folded = self._has_folded
+        return new_player
+
     def __str__(self):
         return f"hand: {self._hand} stack: {self._stack} wager: {self._wager}"
 
@@ -75,47 +293,56 @@ class PlayerState:
 
 # poker game state
 class State:
-    def __init__(self):
+    def __init__(self, config=None):
+        """
+        @param config: GameConfig shared by every state of the solve,
+            defaults to the module ranges with no board
+        """
+        if config is None:
+            config = GameConfig([], p1_range, p2_range)
+        self._config = config
         # current player index (0 oop, 1 ip)
         # 2 chance node, 3 terminal node
         self._current = CHANCE_ID
-        # TODO better intialization
-        self._players = [PlayerState(), PlayerState()]
+        self._players = [PlayerState(config.stack), PlayerState(config.stack)]
         # current number of chips in pot
-        self._pot = 100
+        self._pot = config.pot
         # current streets
-        self._street = RIVER
-        # action sequence
-        self._history = ""
-        # create empty deck
-        self._deck = Deck()
+        self._street = config.street
+        # action sequence, encoded with encode_history
+        self._history_key = 0
+        # mask of cards on the board or in a hand
+        self._dead = config.dead
         # legal actions start as cards to draw
         self._legal_actions = list(range(DECK_SIZE))
-        # array of ints for now
-        self._board = []
+        # array of ints for now, grows as streets are dealt
+        self._board = config.board
+        if self._board:
+            self._update_node_type()
 
     def copy(self):
         """Copy state and return"""
-        new_state = State()
+        new_state = State.__new__(State)
+        new_state._config = self._config
         new_state._current = self._current
-        new_state._players = deepcopy(self._players)
+        new_state._players = [p.copy() for p in self._players]
         new_state._pot = self._pot
         new_state._street = self._street
-        new_state._history = self._history
-        new_state._deck = deepcopy(self._deck)
-        new_state._legal_actions = deepcopy(self._legal_actions)
-        new_state._board = deepcopy(self._board)
+        new_state._history_key = self._history_key
+        new_state._dead = self._dead
+        new_state._legal_actions = list(self._legal_actions)
+        new_state._board = self._board
         return new_state
 
     # TEMPORARY
     def set_board(self, board):
-        self._board = sorted(board)
-        for c in board:
-            self._deck.cards.remove(c)
+        self._config = self._config.with_board(board)
+        self._board = self._config.board
+        self._dead |= self._config.dead
         self._update_node_type()
 
     def __str__(self):
-        return f"""history: {self._history} pot: {self._pot}, board: {self._board}
+        return f"""history: {self.history} pot: {self._pot}, board: {self._board}
     player 1: {self._players[0]}
     player 2: {self._players[1]}"""
 
@@ -145,11 +372,36 @@ class State:
     def is_terminal(self): return self._current == TERMINAL_ID
 
     @property
-    def history(self): return self._history
+    def history(self): return decode_history(self._history_key)
+
+    @property
+    def history_key(self): return self._history_key
+
+    def _push_history(self, c):
+        self._history_key = encode_history(c, self._history_key)
+
+    @property
+    def board(self): return self._board
+
+    @property
+    def street(self): return self._street
+
+    @property
+    def config(self): return self._config
+
+    @property
+    def ranges(self):
+        """Return (p1_range, p2_range) hands are dealt from"""
+        return self._config.ranges
+
+    def infoset_key(self, player):
+        """Return int key of hole cards for player + history"""
+        return infoset_key(player, self._players[player]._hand,
+                self._history_key)
 
     def infoset_str(self, player):
         """Return str repr of hole cards for player + history"""
-        return str(player)+' '+str(self._players[player]._hand)+' '+self.history
+        return decode_infoset_key(self.infoset_key(player))
 
     def _is_player_action_valid(self, action) -> bool:
         """return true if the action is valid for the current state"""
@@ -158,8 +410,10 @@ class State:
             if self.other_player._wager == 0: return True
             return False
         if action == RAISE:
-            # if stack is not zero and other player has bet
-            if self.other_player._wager > 0 and self.current_player._stack > 0:
+            # if stack is not zero and other player has bet without
+            # going all in
+            if self.other_player._wager > 0 and self.current_player._stack > 0 \
+                    and not self.other_player.is_allin:
                 return True
             return False
         if action == CHECK:
@@ -180,24 +434,25 @@ class State:
         """Return legal actions to take"""
         return self._legal_actions
 
+    def public_cards(self) -> list:
+        """Return cards 0..51 not on the board, hands are not removed"""
+        board = card_mask(self._board)
+        return [c for c in range(DECK_SIZE) if not board >> c & 1]
+
     def _legal_dealings(self):
-        global p1_range, p2_range
-        actions = [] # possible indexes to choose from in ranges
-        # player 1 legal dealing
+        # possible indexes to choose from in ranges
         if self._players[0]._hand == None:
-            for (i, combo) in enumerate(p1_range):
-                if not combo[0] in self._deck.cards: continue
-                if not combo[1] in self._deck.cards: continue
-                actions.append(i)
-            return actions
-        # player 2 legal dealings
+            player = 0
         elif self._players[1]._hand == None:
-            for (i, combo) in enumerate(p2_range):
-                if not combo[0] in self._deck.cards: continue
-                if not combo[1] in self._deck.cards: continue
-                actions.append(i)
-
-        return actions
+            player = 1
+        else:
+            # public card, any card not on the board or in a hand
+            return [c for c in range(DECK_SIZE) if not self._dead >> c & 1]
+        masks = range_masks(self._config.ranges[player])
+        # weighted combos not holding a dead card
+        legal = ((masks & np.uint64(self._dead)) == 0) \
+                & (self._config.weights[player] > 0)
+        return np.flatnonzero(legal).tolist()
 
     def _calc_legal_actions(self) -> list:
         """Get all legal actions and return array of
@@ -224,9 +479,12 @@ class State:
             self._legal_actions = self._calc_legal_actions()
             return
 
+        # an all in bet still waits for a call or fold
+        bet_pending = any(p._wager > 0 for p in self._players)
         for p in self._players:
-            if p.has_folded or p.is_allin:
-                # if player has folded or is all in,
+            if p.has_folded or (p.is_allin and not bet_pending
+                    and len(self._board) == 5):
+                # if player has folded or is all in on the river,
                 # we are in a terminal state
                 self._current = TERMINAL_ID
                 self._legal_actions = self._calc_legal_actions()
@@ -234,7 +492,8 @@ class State:
 
         # check if we still need to deal
         for p in self._players:
-            if p._hand == None:
+            if p._hand == None or (p.is_allin and not bet_pending):
+                # hands, or the rest of the board once nobody can bet
                 self._current = CHANCE_ID
                 self._legal_actions = self._calc_legal_actions()
                 return
@@ -251,44 +510,51 @@ class State:
             return
 
         for p in self._players:
-            if p.has_folded or p.is_allin:
+            if p.has_folded:
                 self._current = TERMINAL_ID
                 return
 
-        # TODO add deal cards
+        # deal the next card, wagers start over
+        for p in self._players:
+            p._wager = 0
+        self._current = CHANCE_ID
+        return
+
+    def _deal_public(self, card):
+        """Put card 0..51 on the board and start the next street"""
+        self._history_key = history_card(self._history_key, card)
+        self._board = self._board + [INDEX_CARD[card]]
+        self._dead |= 1 << card
         self._street += 1
         self._current = PLAYER_1_ID
-        return
+        self._update_node_type()
 
     def apply_action(self, action):
         """
         Apply action and return new state
         @param action: BET, CHECK, CALL, ...
-        @param action: if chance node, then index of chance outcome
+        @param action: if chance node, then index of chance outcome,
+            a combo of the range being dealt or a public card 0..51
         """
-        new_state = deepcopy(self)
+        new_state = self.copy()
         action = int(action)
         if new_state.is_terminal: return new_state
+        if new_state.is_chance and all(p._hand is not None
+                for p in new_state._players):
+            new_state._deal_public(action)
+            return new_state
         if new_state.is_chance:
             # apply chance action
             # action is index of combo in player range
             for (i, p) in enumerate(new_state._players):
                 if p._hand == None:
                     # update history
-                    new_state._history += 'd'
+                    new_state._push_history('d')
                     # add card to hand
                     p._hand = action
-                    # remove card
-                    if i == 0:
-                        c1 = p1_range[action][0]
-                        c2 = p1_range[action][1]
-                        new_state._deck.cards.remove(c1)
-                        new_state._deck.cards.remove(c2)
-                    else:
-                        c1 = p2_range[action][0]
-                        c2 = p2_range[action][1]
-                        new_state._deck.cards.remove(c1)
-                        new_state._deck.cards.remove(c2)
+                    # mark cards dead
+                    masks = range_masks(new_state._config.ranges[i])
+                    new_state._dead |= int(masks[action])
                     # calculate node type
                     new_state._current = PLAYER_1_ID
                     new_state._update_node_type()
@@ -296,7 +562,7 @@ class State:
 
         # apply player action
         if action == CHECK:
-            new_state._history += 'x'
+            new_state._push_history('x')
             if new_state.current == PLAYER_1_ID:
                 new_state._current = PLAYER_2_ID
             else:
@@ -304,7 +570,7 @@ class State:
                 new_state._next_street()
 
         if action == BET:
-            new_state._history += 'b'
+            new_state._push_history('b')
             # if has enough chips to bet pot without going all in
             if new_state.current_player._stack >= new_state._pot:
                 new_state.current_player._wager += new_state._pot
@@ -317,31 +583,32 @@ class State:
             new_state._current = 1 - new_state.current
 
         if action == RAISE:
-            new_state._history += 'r'
-            # if has enough chips to 2x other player wager without going allin
-            raise_amt = 0
-            if new_state.current_player._stack >= new_state.other_player._wager:
-                raise_amt = 2 * new_state.other_player._wager
-            else:
-                raise_amt = new_state.current_player._stack
-            new_state.current_player._wager = raise_amt
-            new_state.current_player._stack -= raise_amt
-            new_state._pot += raise_amt
+            new_state._push_history('r')
+            # 2x other player wager, or all in if that is less
+            player = new_state.current_player
+            raise_amt = min(2 * new_state.other_player._wager,
+                    player._wager + player._stack)
+            # only the chips beyond the player's own wager go in
+            player._stack -= raise_amt - player._wager
+            new_state._pot += raise_amt - player._wager
+            player._wager = raise_amt
             new_state._current = 1 - new_state.current
 
         if action == CALL:
-            new_state._history += 'c'
-            other_wager = new_state.other_player._wager
-            if new_state.current_player._stack < other_wager:
+            new_state._push_history('c')
+            # chips to call on top of the caller's own wager
+            to_call = new_state.other_player._wager \
+                    - new_state.current_player._wager
+            if new_state.current_player._stack < to_call:
                 # calculate difference, give other player chips back
-                diff = other_wager - new_state.current_player._stack
+                diff = to_call - new_state.current_player._stack
                 new_state.other_player._stack += diff
-                # pot should now be 2x current player stack
-                new_state._pot = 2 * new_state.current_player.stack
+                # pot loses the uncalled chips and gains the caller's stack
+                new_state._pot += new_state.current_player._stack - diff
                 new_state.current_player._stack = 0
             else:
-                new_state._pot += other_wager
-                new_state.current_player._stack -= other_wager
+                new_state._pot += to_call
+                new_state.current_player._stack -= to_call
 
             # remove other wager
             new_state.other_player._wager = 0
@@ -349,7 +616,7 @@ class State:
             new_state._next_street()
 
         if action == FOLD:
-            new_state._history += 'f'
+            new_state._push_history('f')
             # calculate diffence between bets
             diff = new_state.other_player._wager - new_state.current_player._wager
             # remove difference from pot
@@ -366,7 +633,6 @@ class State:
 
     # return a tuple of utility
     def get_utility(self) -> (float, float):
-        global p1_range, p2_range, evaluator
         # needs to be terminal
         if not self.is_terminal:
             return (0, 0)
@@ -379,6 +645,7 @@ class State:
             return (value, -value)
 
         # evaluate showdown
+        p1_range, p2_range = self._config.ranges
         p1_hand = list(p1_range[self._players[0]._hand])
         p2_hand = list(p2_range[self._players[1]._hand])
 
@@ -0,0 +1,189 @@
+"""
+Read only store of a trained average strategy
+
+The average strategy of a node is normalized the first time the node is
+looked up, so a memory mapped checkpoint is only read where it is used,
+and every later lookup is a dict hit plus a slice:
+
+    store = StrategyStore.from_trainer(trainer)
+    store.strategy(0, 'AhKh', 'dd')    # one hand
+    store.range_strategy('ddb')        # (n_hands x n_actions), whole range
+    store.range_matrix('dd')           # (n_actions x 13 x 13) averages
+"""
+import numpy as np
+from treys import Card
+
+from state import (CHECK, FOLD, CALL, BET, RAISE, SIZED_BET, ALL_IN,
+        encode_history)
+from checkpoint import load_checkpoint
+from isomorphism import IDENTITY, INVERSE
+
+ACTION_NAMES = {CHECK: 'check', FOLD: 'fold', CALL: 'call', BET: 'bet',
+        RAISE: 'raise'}
+
+RANKS = 'AKQJT98765432'
+
+
+def _matrix_cells(combos) -> np.ndarray:
+    """
+    Return flat 13x13 cell of each combo, pairs on the diagonal,
+    suited above it and offsuit below, aces first
+    """
+    cells = np.empty(len(combos), dtype=np.int64)
+    for (i, combo) in enumerate(combos):
+        (r1, s1), (r2, s2) = [Card.int_to_str(c) for c in combo]
+        hi, lo = sorted([RANKS.index(r1), RANKS.index(r2)])
+        if s1 == s2:
+            cells[i] = hi * 13 + lo
+        else:
+            cells[i] = lo * 13 + hi
+    return cells
+
+
+class StrategyStore:
+    """Index over the average strategy of every decision node"""
+    def __init__(self, tree, table):
+        """
+        @param tree: GameTree the strategy was trained on
+        @param table: InfosetTable holding the strategy sums
+        """
+        self._tree = tree
+        self._table = table
+        self._nodes = {int(tree.history_key[node]): node
+                for node in table.decision_nodes()}
+        # node -> (n_rows x n_actions) strategy of the nodes looked up
+        self._blocks = dict()
+
+        # 'AhKh' / 'KhAh' -> combo index, per player
+        self._hands = [dict(), dict()]
+        for player in [0, 1]:
+            for (i, combo) in enumerate(tree.ranges[player]):
+                c1, c2 = [Card.int_to_str(c) for c in combo]
+                self._hands[player][c1 + c2] = i
+                self._hands[player][c2 + c1] = i
+        self._cells = [_matrix_cells(r) for r in tree.ranges]
+
+    @classmethod
+    def from_trainer(cls, trainer):
+        return cls(trainer._tree, trainer._infosets)
+
+    @classmethod
+    def from_checkpoint(cls, path):
+        """Build store from a checkpoint, mapping its arrays read only"""
+        trainer = load_checkpoint(path, mmap_mode='r', restore_rng=False)
+        return cls.from_trainer(trainer)
+
+    def node(self, history) -> int:
+        """Return tree node of history, a str such as 'ddb' or its key"""
+        return self._find(history)[0]
+
+    def _find(self, history) -> (int, np.ndarray):
+        """
+        Return tree node of history and the combo each hand of the acting
+        player plays as there, None if every hand plays as itself
+        """
+        if not isinstance(history, str):
+            return self._nodes[history], None
+        node = self._nodes.get(encode_history(history))
+        if node is not None:
+            return node, None
+        # a card merged into another by suit isomorphism
+        tree = self._tree
+        node, perm = tree.find(history)
+        if perm == IDENTITY or tree.player[node] < 0:
+            return node, None
+        return node, tree.hand_perm(tree.player[node], INVERSE[perm])
+
+    def player(self, history) -> int:
+        """Return acting player at history"""
+        return int(self._tree.player[self.node(history)])
+
+    def actions(self, history) -> list:
+        """
+        Return names of actions available at history, sized bets and
+        raises are named by the wager they make, e.g. 'bet 75'
+        """
+        tree = self._tree
+        node = self.node(history)
+        actions = tree.actions(node)
+        facing = FOLD in actions
+        names = []
+        for (a, child) in zip(actions, tree.children(node)):
+            if a < SIZED_BET:
+                names.append(ACTION_NAMES[a])
+            elif a == ALL_IN:
+                names.append(f'allin {tree.amount[child]}')
+            else:
+                kind = 'raise' if facing else 'bet'
+                names.append(f'{kind} {tree.amount[child]}')
+        return names
+
+    def hand_index(self, player, hand) -> int:
+        """Return combo index of hand, an index or a str such as 'AhKh'"""
+        if isinstance(hand, str):
+            return self._hands[player][hand]
+        return int(hand)
+
+    def strategy(self, player, hand, history) -> np.ndarray:
+        """Return action probabilities of player's hand at history"""
+        node, image = self._find(history)
+        if self._tree.player[node] != player:
+            raise ValueError(f'player {player} does not act at {history}')
+        hand = self.hand_index(player, hand)
+        if image is not None:
+            hand = image[hand]
+        rows = self._table.rows(node)
+        return self._block(node)[hand if rows is None else rows[hand]]
+
+    def _block(self, node) -> np.ndarray:
+        """Return (n_rows x n_actions) strategy at node, normalized once"""
+        block = self._blocks.get(node)
+        if block is None:
+            block = self._table.node_average_strategy(node)
+            block.flags.writeable = False
+            self._blocks[node] = block
+        return block
+
+    def _hand_block(self, node) -> np.ndarray:
+        """Return (n_hands x n_actions) strategy of every hand at node"""
+        return self._table.hand_view(node, self._block(node))
+
+    def range_strategy(self, history) -> np.ndarray:
+        """
+        Return (n_hands x n_actions) strategy of acting player's whole range,
+        rows of hands that can't be dealt are uniform
+        """
+        node, image = self._find(history)
+        block = self._hand_block(node)
+        return block if image is None else block[image]
+
+    def range_matrix(self, history) -> np.ndarray:
+        """
+        Return (n_actions x 13 x 13) mean action probability over the dealt
+        combos of each hand class, nan for classes with no dealt combo
+        """
+        node, image = self._find(history)
+        player = self._tree.player[node]
+        valid = self._tree.live_hands(node, player)
+        block = self._hand_block(node)[valid]
+        if image is not None:
+            # hands playing as the live combos
+            valid = np.argsort(image)[valid]
+        cells = self._cells[player][valid]
+
+        counts = np.bincount(cells, minlength=169)
+        matrix = np.full((block.shape[1], 169), np.nan)
+        for a in range(block.shape[1]):
+            sums = np.bincount(cells, weights=block[:, a], minlength=169)
+            np.divide(sums, counts, out=matrix[a], where=counts > 0)
+        return matrix.reshape(-1, 13, 13)
+
+    def export_matrices(self, histories=None) -> dict:
+        """
+        Return dict of history -> (action names, range matrix) for every
+        decision node, or only the given histories
+        """
+        if histories is None:
+            tree = self._tree
+            histories = [tree.history(node) for node in self._nodes.values()]
+        return {h: (self.actions(h), self.range_matrix(h)) for h in histories}
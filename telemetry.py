@@ -0,0 +1,224 @@
+"""
+Training telemetry
+
+A Telemetry attached to a trainer is called after every iteration. Every
+`every` iterations it writes a sample of the trainer's counters and
+timing to its sinks, and every `exploitability_every` iterations the
+exploitability of the average strategy. Callbacks run after every
+iteration and stop training by returning True.
+
+    telemetry = Telemetry(JsonlSink('run.jsonl'), every=100,
+            exploitability_every=1000, target_mbb=5, profile=True)
+    trainer.set_telemetry(telemetry)
+    trainer.train(100000)
+    telemetry.close()
+
+Records are dicts with an 'event' key:
+
+    start           trainer, options, tree and table sizes
+    sample          iteration, train seconds, iterations/sec since the last
+                    sample, node counters, seconds per profiled section
+    exploitability  iteration, chips, mbb/pot, infosets reached and the
+                    seconds spent evaluating
+    end             last sample, written on close
+
+Time spent in telemetry itself is left out of train seconds. Trainers
+without a telemetry only pay an `is None` check per iteration, and the
+profiled sections are only wrapped while profile is on.
+"""
+import json
+import time
+
+from exploitability import exploitability_report
+
+
+class JsonlSink:
+    """Append records to a file, one json object per line"""
+    def __init__(self, path, mode='a'):
+        self._file = open(path, mode)
+
+    def write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        # flush so a running solve can be followed with tail -f
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class MemorySink:
+    """Keep records in a list"""
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+    def events(self, event) -> list:
+        """Return records of one event type"""
+        return [r for r in self.records if r['event'] == event]
+
+
+def _sections(trainer) -> dict:
+    """Return section name -> (object, method name) timed when profiling"""
+    if hasattr(trainer, '_terminals'):
+        # range vs range trainers
+        return {'terminal': (trainer._terminals, 'values'),
+                'strategy': (trainer, 'get_strategy')}
+    return {'terminal': (trainer._tree, 'utility'),
+            'infoset': (trainer, 'get_infoset'),
+            'update': (trainer, 'update')}
+
+
+class Telemetry:
+    """Streams counters, timing and exploitability of a training run"""
+    def __init__(self, *sinks, every=1, exploitability_every=None,
+            target_mbb=None, profile=False, callbacks=()):
+        """
+        @param sinks: objects with a write(record) method
+        @param every: iterations between samples
+        @param exploitability_every: iterations between exploitability
+            samples, None for never
+        @param target_mbb: stop training once sampled exploitability in
+            mbb/pot is at or below this
+        @param profile: time the trainer's terminal evaluation, strategy
+            and update methods, not timed in ParallelMCCFRTrainer workers
+        @param callbacks: functions of (trainer, telemetry), called after
+            every iteration, returning True stops training
+        """
+        self._sinks = list(sinks)
+        self.every = every
+        self.exploitability_every = exploitability_every
+        self.target_mbb = target_mbb
+        self.profile = profile
+        self._callbacks = list(callbacks)
+        self.last_exploitability = None
+        self._trainer = None
+
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def emit(self, record):
+        for sink in self._sinks:
+            sink.write(record)
+
+    def attach(self, trainer):
+        """Start timing trainer, called by trainer.set_telemetry"""
+        self._trainer = trainer
+        self._seconds = dict()
+        if self.profile:
+            for (name, (obj, method)) in _sections(trainer).items():
+                self._seconds[name] = 0.0
+                setattr(obj, method, self._timed(name, getattr(obj, method)))
+
+        self._overhead = 0.0
+        self._t0 = time.perf_counter()
+        self._last = (trainer.iterations, 0.0)
+        self._last_exploitability = trainer.iterations
+
+        tree = trainer._tree
+        self.emit({'event': 'start', 'trainer': type(trainer).__name__,
+            'config': trainer.config(), 'iteration': trainer.iterations,
+            'nodes': int(tree.n_nodes),
+            'infosets': len(trainer._infosets),
+            'table_bytes': int(trainer._infosets.nbytes)})
+
+    def detach(self, trainer):
+        """Stop timing trainer, restoring its profiled methods"""
+        if self.profile:
+            for (obj, method) in _sections(trainer).values():
+                if method in vars(obj):
+                    delattr(obj, method)
+        self._trainer = None
+
+    def _timed(self, name, f):
+        seconds = self._seconds
+        clock = time.perf_counter
+        def timed(*args, **kwargs):
+            t0 = clock()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                seconds[name] += clock() - t0
+        return timed
+
+    def train_seconds(self) -> float:
+        """Seconds since attaching, not counting telemetry's own time"""
+        return time.perf_counter() - self._t0 - self._overhead
+
+    def on_iteration(self, trainer) -> bool:
+        """
+        Called by the trainer after each iteration, or batch of iterations
+        @return: True to stop training
+        """
+        t0 = time.perf_counter()
+        t = trainer.iterations
+        if t - self._last[0] >= self.every:
+            self.sample(trainer)
+        if self.exploitability_every is not None \
+                and t - self._last_exploitability >= self.exploitability_every:
+            self.sample_exploitability(trainer)
+
+        stop = self.target_mbb is not None \
+                and self.last_exploitability is not None \
+                and self.last_exploitability['mbb_per_pot'] <= self.target_mbb
+        for callback in self._callbacks:
+            if callback(trainer, self):
+                stop = True
+        self._overhead += time.perf_counter() - t0
+        return stop
+
+    def counters(self, trainer) -> dict:
+        touched = trainer._nodes_touched
+        terminal = trainer._terminal_evals
+        chance = trainer._chance_nodes
+        return {'nodes_touched': int(touched),
+                'decision_nodes': int(touched - terminal - chance),
+                'chance_nodes': int(chance),
+                'terminal_evaluations': int(terminal),
+                'nodes_pruned': int(getattr(trainer, '_nodes_pruned', 0))}
+
+    def sample(self, trainer, event='sample'):
+        """Write counters and timing of trainer"""
+        t = trainer.iterations
+        seconds = self.train_seconds()
+        last_t, last_seconds = self._last
+        record = {'event': event, 'iteration': t, 'seconds': seconds,
+                'iterations_per_sec': (t - last_t) / (seconds - last_seconds)
+                    if seconds > last_seconds else 0.0}
+        record.update(self.counters(trainer))
+        if self._seconds:
+            record['profile'] = dict(self._seconds)
+        self._last = (t, seconds)
+        self.emit(record)
+        return record
+
+    def sample_exploitability(self, trainer):
+        """Evaluate and write exploitability of trainer's average strategy"""
+        t0 = time.perf_counter()
+        record = {'event': 'exploitability', 'iteration': trainer.iterations,
+                'train_seconds': self.train_seconds()}
+        # best response reuses the trainer's terminal evaluator, its time
+        # in profiled sections is not training time
+        profiled = dict(self._seconds)
+        record.update(exploitability_report(trainer))
+        self._seconds.update(profiled)
+        record['infosets_reached'] = trainer._infosets.n_reached()
+        record['seconds'] = time.perf_counter() - t0
+        self._last_exploitability = trainer.iterations
+        self.last_exploitability = record
+        self.emit(record)
+        return record
+
+    def close(self):
+        """Write an end sample, detach and close the sinks"""
+        trainer = self._trainer
+        if trainer is not None:
+            self.sample(trainer, event='end')
+            trainer.set_telemetry(None)
+        for sink in self._sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
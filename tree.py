@@ -0,0 +1,555 @@
+import collections
+import numpy as np
+import random
+from treys import Card
+
+from state import (CHANCE_ID, TERMINAL_ID,
+        DECK_SIZE, INDEX_CARD, encode_history, decode_history, infoset_key,
+        decode_infoset_key, CARD_INDEX, card_mask, range_masks, range_cards,
+        _range_table)
+from equity import range_ranks
+from isomorphism import (IDENTITY, INVERSE, board_symmetries, card_orbits,
+        combo_perm, combo_rows, compose, permute_card, range_symmetries)
+
+# terminal payoff kinds
+NOT_TERMINAL = -1
+SHOWDOWN = 0
+P1_FOLDED = 1
+P2_FOLDED = 2
+
+ROOT = 0
+
+class ChanceTable:
+    """
+    Private chance outcomes of a board, computed once per board and ranges
+
+    A (p1, p2) combo pair that shares no card with the other or the board
+    is dealt with probability proportional to the product of the two combo
+    weights, which is exact card removal for weighted ranges.
+    """
+    def __init__(self, board, ranges, weights=None):
+        """
+        @param board: list of treys cards
+        @param ranges: (p1, p2) lists of combos
+        @param weights: (p1, p2) arrays of combo weights, all 1 if None
+        """
+        if weights is None:
+            weights = [np.ones(len(r)) for r in ranges]
+        dead = np.uint64(card_mask(board))
+        masks = [range_masks(r) for r in ranges]
+        weights = [np.where((m & dead) == 0, w, 0)
+                for (m, w) in zip(masks, weights)]
+        # (n_p1 x n_p2) mask of pairs that can be dealt together
+        self.compatible = ((masks[0][:, None] & masks[1][None, :]) == 0) \
+                & (weights[0] > 0)[:, None] & (weights[1] > 0)[None, :]
+        # (n_pairs x 2) combo indexes of every pair, grouped by p1 combo
+        self.pairs = np.argwhere(self.compatible)
+        self.n_pairs = len(self.pairs)
+        # one over the total weight of every pair
+        pair_weight = weights[0][self.pairs[:, 0]] * weights[1][self.pairs[:, 1]]
+        self.norm = 1 / pair_weight.sum()
+        # probability of each pair being dealt
+        self.pair_prob = pair_weight * self.norm
+        self._cumulative = np.cumsum(self.pair_prob)
+        # marginal probability of each combo of each player
+        self.hand_prob = [
+                weights[0] * (self.compatible @ weights[1]) * self.norm,
+                weights[1] * (self.compatible.T @ weights[0]) * self.norm]
+        # combos of each player that can be dealt
+        self.valid = [np.flatnonzero(p > 0) for p in self.hand_prob]
+        # weight of each combo, zero for combos that can't be dealt
+        self.weights = [np.where(p > 0, w, 0)
+                for (p, w) in zip(self.hand_prob, weights)]
+
+    def deals(self, h1) -> np.ndarray:
+        """Return p2 combos that can be dealt with p1 combo h1"""
+        return np.flatnonzero(self.compatible[h1])
+
+    def sample(self) -> ((int, int), float):
+        """Sample a (p1, p2) pair, return it and its probability"""
+        i = np.searchsorted(self._cumulative, random.random(), side='right')
+        i = min(i, self.n_pairs - 1)
+        h1, h2 = self.pairs[i]
+        return (int(h1), int(h2)), self.pair_prob[i]
+
+
+def range_unblocked(combos) -> np.ndarray:
+    """
+    Return (52 x n_combos) array, 1 where the combo does not hold the card,
+    cached per range
+    """
+    def build(combos):
+        cards = range_cards(combos)
+        unblocked = np.ones((DECK_SIZE, len(combos)))
+        for i in [0, 1]:
+            unblocked[cards[:, i], np.arange(len(combos))] = 0
+        unblocked.flags.writeable = False
+        return unblocked
+    return _range_table(combos, 'unblocked', build)
+
+
+class GameTree:
+    """Public betting tree stored as flat arrays indexed by node id
+
+    Nodes of a street are laid out breadth first, so the children of node
+    n are the contiguous ids child_start[n] ... child_start[n] +
+    n_children[n] - 1 and action[c] is the action id that leads from the
+    parent into c. Chance nodes deal the next public card, action[c] is
+    the card 0..51. Everything below one dealt card, its runout, is laid
+    out as one contiguous block after the cards, so each runout's nodes
+    and infosets can be handed to a separate worker, see runouts().
+
+    With suit isomorphism, a chance child stands for every card its card
+    maps to under a suit permutation of the runout, deal_perms lists the
+    permutations, and combos mapped onto each other share an infoset row.
+    """
+    def __init__(self):
+        # current id of each node (player id, chance or terminal)
+        self.node_type = None
+        # acting player at decision nodes, -1 otherwise
+        self.player = None
+        # chips in the pot at each node
+        self.pot = None
+        # offset of first child and number of children
+        self.child_start = None
+        self.n_children = None
+        # action leading into each node, -1 for the root
+        self.action = None
+        # wager of the acting player after that action, 0 for trees
+        # built without a betting.BetSizing
+        self.amount = None
+        self.parent = None
+        # number of nodes in subtree rooted at each node
+        self.subtree_size = None
+        # SHOWDOWN, P1_FOLDED or P2_FOLDED at terminals
+        self.payoff = None
+        # encoded action sequence of each node, see state.encode_history
+        self.history_key = None
+        # runout of each node, index of a row of runout_cards
+        self.runout = None
+        # (n_runouts x n_deals) public cards dealt so far, -1 padded
+        self.runout_cards = None
+        # probability of the card dealt into each chance child for a dealt
+        # pair of hands not holding it, 1 for other nodes
+        self.deal_prob = None
+        # (n_nodes x 4) suit perms mapping the card of each chance child
+        # to each card it stands for, -1 padded, see isomorphism.py
+        self.deal_perms = None
+        # board, ranges and combo weights the tree was built for
+        self.board = []
+        self.ranges = ([], [])
+        self.weights = (None, None)
+        # ChanceTable of private deals
+        self.chance = None
+        # showdown score of each combo (lower is better)
+        self.ranks = (None, None)
+        # per player (52 x n_hands), 0 where a hand holds the card
+        self.unblocked = (None, None)
+        # runout -> scores of each combo on its board
+        self._runout_ranks = dict()
+        # suit perms mapping both weighted ranges onto themselves, None
+        # without suit isomorphism
+        self.symmetries = None
+        # (player, perm) -> combo index of each relabeled combo
+        self._combo_perms = dict()
+        # abstraction.CardAbstraction bucketing combos, None for none
+        self.abstraction = None
+        # (runout, player) -> infoset row of each combo, None if unshared
+        self._hand_rows = dict()
+
+    def __len__(self):
+        return len(self.node_type)
+
+    @property
+    def n_nodes(self): return len(self.node_type)
+
+    def is_terminal(self, node):
+        return self.node_type[node] == TERMINAL_ID
+
+    def is_chance(self, node):
+        return self.node_type[node] == CHANCE_ID
+
+    def children(self, node):
+        """Return range of child node ids"""
+        start = self.child_start[node]
+        return range(start, start + self.n_children[node])
+
+    def actions(self, node):
+        """Return action ids available at node"""
+        start = self.child_start[node]
+        return self.action[start:start + self.n_children[node]]
+
+    def runouts(self, node) -> list:
+        """
+        Return (card, child, range of nodes below child) of every card
+        dealt at chance node, the subtrees share no node or infoset
+        """
+        return [(int(self.action[child]), child,
+            range(self.child_start[child],
+                self.child_start[child] + self.subtree_size[child] - 1))
+            for child in self.children(node)]
+
+    def runout_board(self, runout) -> list:
+        """Return board of runout, as treys cards"""
+        return self.board + [INDEX_CARD[c]
+                for c in self.runout_cards[runout] if c >= 0]
+
+    def board_ranks(self, runout) -> tuple:
+        """Return (p1, p2) scores of each combo on board of runout"""
+        if runout == 0:
+            return self.ranks
+        ranks = self._runout_ranks.get(runout)
+        if ranks is None:
+            ranks = self._runout_ranks[runout] = _rank_ranges(
+                    self.runout_board(runout), self.ranges)
+        return ranks
+
+    def live_hands(self, node, player) -> np.ndarray:
+        """Return combos of player that can be dealt at node"""
+        valid = self.chance.valid[player]
+        for c in self.runout_cards[self.runout[node]]:
+            if c < 0: break
+            valid = valid[self.unblocked[player][c, valid] > 0]
+        return valid
+
+    def hand_perm(self, player, perm) -> np.ndarray:
+        """Return combo each combo of player is mapped from by perm"""
+        image = self._combo_perms.get((player, perm))
+        if image is None:
+            image = self._combo_perms[player, perm] = combo_perm(
+                    self.ranges[player], INVERSE[perm])
+        return image
+
+    def deal_values(self, child, player, values) -> np.ndarray:
+        """
+        Return values of player's hands below chance child, summed over
+        every card the child stands for
+        """
+        total = 0
+        for perm in self.deal_perms[child]:
+            if perm < 0: break
+            if perm == IDENTITY:
+                total = total + values
+            else:
+                total = total + values[self.hand_perm(player, perm)]
+        return total
+
+    def deal_hands(self, child, hands) -> list:
+        """
+        Return hands, for each card chance child stands for, as the hands
+        they are mapped to in the child's subtree
+        """
+        return [hands if perm == IDENTITY else
+                tuple(int(self.hand_perm(p, perm)[hands[p]]) for p in [0, 1])
+                for perm in self.deal_perms[child] if perm >= 0]
+
+    def hand_rows(self, node, player) -> np.ndarray:
+        """
+        Return infoset row of each combo of player at node, None when
+        every combo has its own row
+        """
+        if self.symmetries is None and self.abstraction is None:
+            return None
+        runout = int(self.runout[node])
+        key = (runout, player)
+        if key not in self._hand_rows:
+            rows = None
+            if self.abstraction is not None:
+                # buckets of the board, equal features share a bucket so
+                # they already merge isomorphic combos
+                rows = self.abstraction.buckets(self.runout_board(runout),
+                        self.ranges, self.weights, player)
+            else:
+                board = [CARD_INDEX[c] for c in self.runout_board(runout)]
+                perms = board_symmetries(board, self.symmetries)
+                if len(perms) > 1:
+                    rows, _ = combo_rows(self.ranges[player], perms)
+            self._hand_rows[key] = rows
+        return self._hand_rows[key]
+
+    def find(self, history) -> (int, int):
+        """
+        Return node of a history str and the suit perm mapping its cards
+        onto the node's, IDENTITY unless a card it deals was merged into
+        another by suit isomorphism
+        @raise KeyError: if history is not in the tree
+        """
+        node, perm = ROOT, IDENTITY
+        prefix = self.history(ROOT)
+        if not history.startswith(prefix):
+            raise KeyError(history)
+        i = len(prefix)
+        while i < len(history):
+            if history[i] == '/':
+                card = permute_card(
+                        CARD_INDEX[Card.new(history[i + 1:i + 3])], perm)
+                node, dealt = self._deal_child(node, card, history)
+                perm = compose(perm, INVERSE[dealt])
+                i += 3
+                continue
+            key = encode_history(history[i], int(self.history_key[node]))
+            for child in self.children(node):
+                if self.history_key[child] == key: break
+            else:
+                raise KeyError(history)
+            node = child
+            i += 1
+        return node, perm
+
+    def _deal_child(self, node, card, history) -> (int, int):
+        """Return chance child dealing card and the perm mapping it there"""
+        if self.is_chance(node):
+            for child in self.children(node):
+                for perm in self.deal_perms[child]:
+                    if perm < 0: break
+                    if permute_card(int(self.action[child]), perm) == card:
+                        return child, int(perm)
+        raise KeyError(history)
+
+    def history(self, node) -> str:
+        """Return action sequence of node, for display"""
+        return decode_history(int(self.history_key[node]))
+
+    def infoset_key(self, node, hands) -> int:
+        """Return int key of hole cards for acting player + history"""
+        player = int(self.player[node])
+        return infoset_key(player, int(hands[player]),
+                int(self.history_key[node]))
+
+    def infoset_str(self, node, hands):
+        """Return str repr of hole cards for acting player + history"""
+        return decode_infoset_key(self.infoset_key(node, hands))
+
+    def utility(self, node, hands) -> (float, float):
+        """Return utility tuple of terminal node for dealt hands"""
+        value = self.pot[node] / 2.0
+        payoff = self.payoff[node]
+        if payoff == P1_FOLDED:
+            return (-value, value)
+        if payoff == P2_FOLDED:
+            return (value, -value)
+
+        ranks = self.board_ranks(self.runout[node])
+        p1_score = ranks[0][hands[0]]
+        p2_score = ranks[1][hands[1]]
+        if p1_score == p2_score: return (0, 0)
+        # lower score is better
+        elif p1_score < p2_score:
+            return (value, -value)
+        else:
+            return (-value, value)
+
+
+def _rank_ranges(board, ranges):
+    """
+    Score each combo of both ranges on board, read from the board's
+    table of every combo, blocked combos are never dealt and score 0
+    """
+    return tuple(range_ranks(board, combos) for combos in ranges)
+
+
+# betting arrays of the trees built last, keyed by _betting_key of the
+# root, least recently used dropped first, as flop trees can be large
+CACHED_TREES = 8
+_betting_cache = collections.OrderedDict()
+
+def _betting_key(root, symmetries=None):
+    """Everything about the root that shapes the betting tree"""
+    sizing = root.config.betting
+    return (root._pot, root._street,
+            tuple((p._stack, p._wager) for p in root._players),
+            None if sizing is None else sizing.key(),
+            # cards left to deal, river trees are shared by every board
+            card_mask(root.board) if len(root.board) < 5 else None,
+            None if symmetries is None else tuple(symmetries))
+
+
+def _key_array(keys) -> np.ndarray:
+    """Return history keys as int64, or python ints when they overflow"""
+    if max(keys) < 2 ** 63:
+        return np.array(keys, dtype=np.int64)
+    return np.array(keys, dtype=object)
+
+
+def layout_tree(root, expand, board=(), symmetries=None) -> dict:
+    """
+    Lay out the tree below root, return tree arrays
+    nodes of a street are placed breadth first, and the runout below each
+    card of a chance node is placed after them in one contiguous block
+    @param expand: function of a node returning (node type, player, pot,
+        payoff, history key, [(action, amount, child node), ...])
+    @param board: cards 0..51 on the board at root
+    @param symmetries: suit perms of the ranges, cards of a chance node
+        mapped onto each other by the ones fixing the board are merged
+    """
+    nodes, action, amount, parent = [root], [-1], [0], [-1]
+    info = [None]
+    child_start, n_children = [0], [0]
+    # cards dealt above each node
+    dealt = [()]
+    deal_prob = [1.0]
+    deal_perms = [(IDENTITY,)]
+
+    def add_children(i, children):
+        child_start[i] = len(nodes)
+        n_children[i] = len(children)
+        for (a, to, child) in children:
+            nodes.append(child)
+            action.append(a)
+            amount.append(to)
+            parent.append(i)
+            info.append(None)
+            child_start.append(0)
+            n_children.append(0)
+            dealt.append(dealt[i])
+            deal_prob.append(1.0)
+            deal_perms.append((IDENTITY,))
+
+    def add_deals(i, children):
+        # a dealt pair of hands blocks 4 of the cards
+        prob = 1 / (len(children) - 4)
+        perms = {a: (IDENTITY,) for (a, _, _) in children}
+        if symmetries is not None:
+            group = board_symmetries(tuple(board) + dealt[i], symmetries)
+            perms = dict(card_orbits(perms, group))
+            children = [c for c in children if c[0] in perms]
+        add_children(i, children)
+        for child in range(child_start[i], len(nodes)):
+            dealt[child] = dealt[i] + (action[child],)
+            deal_prob[child] = prob
+            deal_perms[child] = perms[action[child]]
+
+    def lay_street(first):
+        queue = [first]
+        chance = []
+        for i in queue:
+            info[i] = expand(nodes[i])
+            if info[i][0] == CHANCE_ID:
+                chance.append(i)
+                continue
+            add_children(i, info[i][5])
+            queue.extend(range(child_start[i], len(nodes)))
+        # then every runout of every chance node, one after the other
+        for i in chance:
+            add_deals(i, info[i][5])
+            for child in range(child_start[i], len(nodes)):
+                lay_street(child)
+
+    lay_street(0)
+    node_type, player, pot, payoff, history_key, _ = zip(*info)
+    n = len(nodes)
+
+    # runout of each node, a new one below each dealt card
+    runout = np.zeros(n, dtype=np.int32)
+    cards = [()]
+    for node in range(1, n):
+        p = parent[node]
+        if node_type[p] != CHANCE_ID:
+            runout[node] = runout[p]
+            continue
+        runout[node] = len(cards)
+        cards.append(dealt[node])
+    depth = max(len(c) for c in cards)
+    perms = np.full((n, 4), -1, dtype=np.int8)
+    for (node, p) in enumerate(deal_perms):
+        perms[node, :len(p)] = p
+    runout_cards = np.full((len(cards), depth), -1, dtype=np.int8)
+    for (r, c) in enumerate(cards):
+        runout_cards[r, :len(c)] = c
+
+    betting = {
+        'node_type': np.array(node_type, dtype=np.int8),
+        'player': np.array(player, dtype=np.int8),
+        'pot': np.array(pot, dtype=np.float64),
+        'child_start': np.array(child_start, dtype=np.int32),
+        'n_children': np.array(n_children, dtype=np.int32),
+        'action': np.array(action, dtype=np.int8),
+        'parent': np.array(parent, dtype=np.int32),
+        'payoff': np.array(payoff, dtype=np.int8),
+        'history_key': _key_array(history_key),
+        'amount': np.array(amount, dtype=np.int64),
+        'runout': runout,
+        'runout_cards': runout_cards,
+        'deal_prob': np.array(deal_prob),
+        'deal_perms': perms,
+    }
+
+    # children always come after their parent
+    subtree_size = np.ones(n, dtype=np.int64)
+    for node in range(n - 1, 0, -1):
+        subtree_size[parent[node]] += subtree_size[node]
+    betting['subtree_size'] = subtree_size
+
+    # shared by every tree with the same betting, never written to
+    for array in betting.values():
+        array.flags.writeable = False
+    return betting
+
+
+def _expand_state(state):
+    """expand function of layout_tree for State nodes"""
+    if state.is_terminal:
+        if state._players[0].has_folded:
+            payoff = P1_FOLDED
+        elif state._players[1].has_folded:
+            payoff = P2_FOLDED
+        else:
+            payoff = SHOWDOWN
+        return (TERMINAL_ID, -1, state._pot, payoff, state.history_key, [])
+    if state.is_chance:
+        # every card not on the board, hands are removed per deal
+        return (CHANCE_ID, -1, state._pot, NOT_TERMINAL, state.history_key,
+                [(c, 0, state.apply_action(c)) for c in state.public_cards()])
+    return (state.current, state.current, state._pot, NOT_TERMINAL,
+            state.history_key,
+            [(a, 0, state.apply_action(a)) for a in state.legal_actions])
+
+
+def _build_betting(dealt, symmetries=None) -> dict:
+    """Walk betting from state with both hands dealt, return tree arrays"""
+    board = [CARD_INDEX[c] for c in dealt.board]
+    return layout_tree(dealt, _expand_state, board, symmetries)
+
+
+def build_tree(root) -> GameTree:
+    """
+    Walk the betting abstraction once and return flat GameTree
+    the betting arrays are cached, so trees of other boards or ranges
+    with the same betting only compute their chance table and ranks
+    @param root: initial state, before hands are dealt
+    """
+    assert(root.is_chance)
+    tree = GameTree()
+    tree.board = list(root.board)
+    tree.ranges = root.ranges
+    tree.weights = root.config.weights
+    tree.abstraction = root.config.abstraction
+
+    # enumerate private chance outcomes once
+    tree.chance = ChanceTable(tree.board, tree.ranges, root.config.weights)
+    tree.ranks = _rank_ranges(tree.board, tree.ranges)
+    tree.unblocked = tuple(range_unblocked(r) for r in tree.ranges)
+    if root.config.isomorphism:
+        tree.symmetries = range_symmetries(tree.ranges, root.config.weights)
+
+    # dealt cards are merged by the suit perms of the ranges
+    symmetries = tree.symmetries if len(tree.board) < 5 else None
+
+    # betting does not depend on which combos were dealt
+    key = _betting_key(root, symmetries)
+    betting = _betting_cache.get(key)
+    if betting is None:
+        if root.config.betting is not None:
+            betting = root.config.betting.build(root.config, symmetries)
+        else:
+            h1, h2 = tree.chance.pairs[0]
+            betting = _build_betting(root.apply_action(h1).apply_action(h2),
+                    symmetries)
+        _betting_cache[key] = betting
+        if len(_betting_cache) > CACHED_TREES:
+            _betting_cache.popitem(last=False)
+    else:
+        _betting_cache.move_to_end(key)
+    for (name, array) in betting.items():
+        setattr(tree, name, array)
+    return tree